@@ -3,101 +3,531 @@
 `segment` in function arguments stands for AudioSegment.
 """
 import os.path
+import queue
 import random
+import subprocess
 import threading
+import time
+import weakref
 
-from pydub.utils import make_chunks
+from pydub.utils import db_to_float
 from mutagen.easyid3 import EasyID3
-import pyaudio
+from mutagen.mp3 import MONO, MP3
+import numpy
 import pydub
 
+import cache
+import config
+import dsp
+import health
+import timing
+
 
 SEGMENT_LENGTH_SECONDS = 35  # 35
 MINIMUM_STARTING_POINT = 30  # skip at least 30 seconds from the beginning
 MAXIMUM_STARTING_POINT = 90  # ...and no more than 90 seconds
+VOLUME_CHANGER_DECREASE = 15  # in dB
+DECODE_MARGIN = 500  # in ms, decoded around requested part of the track
 
-_CURRENT_SONG_PLAYER = None
+_PLAYER = None
+_PEAKS = {}
+_POOL = dsp.BufferPool(config.BUFFER_POOL_SIZE)
 
 
-class PyaudioPlayer(threading.Thread):
-    """Improved audio player, based on pydub.playback
+class _BufferSource(object):
+    """Source of audio for the player, reading straight from raw data
 
-    This player is based on threading, with simple method to stop playing
-    without raising KeyboardInterruption.
+    Chunks are read-only slices of the data, nothing is copied.
     """
-    def __init__(self, segment, notifier=None):
-        super(PyaudioPlayer, self).__init__()
-        self.segment = segment
-        self._playing = True
-        self._notifier = notifier
+    def __init__(self, data):
+        self._data = memoryview(data).cast('B').toreadonly()
+        self.position = 0
+        self.finished = False
+        self.error = None
 
-    def run(self):
-        player = pyaudio.PyAudio()
-        stream = player.open(
-            format=player.get_format_from_width(self.segment.sample_width),
-            channels=self.segment.channels,
-            rate=self.segment.frame_rate,
-            output=True,
-        )
+    def read(self, size):
+        chunk = self._data[self.position:self.position + size]
+        self.position += len(chunk)
+        self.finished = self.position >= len(self._data)
+        return chunk
 
-        # break audio into quarter-second chunks (to allows interrupts)
-        for i, chunk in enumerate(make_chunks(self.segment, 250)):
-            if self._notifier:
-                self._notifier(i*250)
-            if not self._playing:
-                break
-            stream.write(chunk._data)
+    def fill(self):
+        """Whole track is in memory, so there's no buffer to measure"""
+        return None
 
-        stream.stop_stream()
-        stream.close()
-        player.terminate()
+    def close(self):
+        pass
 
-    def stop(self):
-        """Stops playing current song"""
-        self._playing = False
 
+class _BlockSource(object):
+    """Source of audio for the player, reading from generator of blocks
+
+    Blocks are pulled from the generator by separate thread, a few blocks
+    ahead, so that rendering them doesn't hold up the device. If rendering
+    fails, the source finishes early and the exception is kept in `error`.
+    """
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._queue = queue.Queue(config.STREAM_QUEUE_BLOCKS)
+        self._pending = b''
+        self._closed = threading.Event()
+        self._rendered = False  # all blocks were pulled from the generator
+        self._exhausted = False
+        self.position = 0
+        self.finished = False
+        self.error = None
+        thread = threading.Thread(target=self._feed)
+        thread.daemon = True
+        thread.start()
+
+    def _feed(self):
+        try:
+            for block in self._blocks:
+                if not self._put(block):
+                    return
+        except Exception as e:
+            self.error = e
+        self._rendered = True
+        self._put(None)
+
+    def _put(self, block):
+        """Puts block in the queue, returns False if source was closed"""
+        while not self._closed.is_set():
+            try:
+                self._queue.put(block, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(self, size):
+        while len(self._pending) < size and not self._exhausted:
+            try:
+                block = self._queue.get_nowait()
+            except queue.Empty:
+                break  # not rendered yet, silence will be played instead
+            if block is None:
+                self._exhausted = True
+            else:
+                self._pending += block
+        chunk = self._pending[:size]
+        self._pending = self._pending[size:]
+        self.position += len(chunk)
+        self.finished = self._exhausted and not self._pending
+        return chunk
+
+    def fill(self):
+        """Returns how full the queue of rendered blocks is (0-1)
+
+        None when all blocks were rendered already, as the queue empties then
+        anyway.
+        """
+        if self._rendered:
+            return None
+        return self._queue.qsize() / self._queue.maxsize
+
+    def close(self):
+        self._closed.set()
+
+
+class PyaudioPlayer(object):
+    """Low-latency audio player, with single output stream for whole session
+
+    Device is fed by PyAudio in callback mode, straight from the segment's raw
+    data, so switching tracks doesn't require opening the device again. When
+    nothing is being played, silence is sent to the device.
+    Stream is reopened only when format of the next track is different.
+    Optional effects (see `stream.Effects`) are applied to every period of
+    audio right before it's sent to the device, so they can be changed while
+    playing.
+    Position of the track being played is only published in `position`
+    attribute - nothing else is done from the audio thread, it's up to the
+    interface to read it, along with `error` which stopped the track.
+    Health of the playback is measured in `stats` (see `health.Stats`),
+    unless it's disabled in the config.
+    """
+    def __init__(self, period_size=None):
+        self._period_size = period_size or config.PLAYER_PERIOD_SIZE
+        self._pyaudio = None
+        self._continue = None
+        self._underflow = 0
+        self._latency = 0
+        self._stream = None
+        self._format = None
+        self._frame_width = 0
+        self._silence = b''
+        self._lock = threading.Lock()
+        self._source = None
+        self._effects = None
+        self.position = None  # in ms, None when nothing is being played
+        self.error = None
+        self.stats = None
+
+    def play(self, segment, effects=None, started=None):
+        """Starts playing the segment, stopping previous one
+
+        `started` is `time.perf_counter()` of the moment play was requested,
+        time to the first sample is measured from it (from now by default).
+        """
+        self._start(
+            _BufferSource(segment._data),
+            (segment.sample_width, segment.channels, segment.frame_rate),
+            effects,
+            started,
+        )
+
+    def play_blocks(self, blocks, stream_format, effects=None, started=None):
+        """Starts playing raw PCM blocks as they are yielded by generator
+
+        `stream_format` must have `frame_rate`, `channels` and `sample_width`
+        attributes. `started` works like in `play`.
+        """
+        self._start(
+            _BlockSource(blocks),
+            (
+                stream_format.sample_width,
+                stream_format.channels,
+                stream_format.frame_rate,
+            ),
+            effects,
+            started,
+        )
 
-def play(segment, notifier=None):
+    def stop(self):
+        """Stops playing current song"""
+        with self._lock:
+            source = self._source
+            self._source = None
+            self._effects = None
+            self.position = None
+        if source:
+            source.close()
+
+    def close(self):
+        """Closes output stream and releases the device"""
+        self.stop()
+        health.save(self.stats)
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+            self._format = None
+        if self._pyaudio:
+            self._pyaudio.terminate()
+            self._pyaudio = None
+
+    def _start(self, source, stream_format, effects=None, started=None):
+        self.stop()
+        if stream_format != self._format:
+            with timing.stage('device'):
+                self._open(stream_format)
+        health.save(self.stats)
+        stats = None
+        if config.HEALTH_ENABLED:
+            stats = health.Stats(
+                self._period_size,
+                self._format[2],
+                self._latency,
+                started,
+            )
+        with self._lock:
+            self.stats = stats
+            self._source = source
+            self._effects = effects
+            self.position = 0
+            self.error = None
+
+    def _open(self, stream_format):
+        """Opens output stream with given format"""
+        sample_width, channels, frame_rate = stream_format
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+        if not self._pyaudio:
+            # Imported here, as initializing PyAudio takes a while
+            import pyaudio
+            self._pyaudio = pyaudio.PyAudio()
+            self._continue = pyaudio.paContinue
+            self._underflow = pyaudio.paOutputUnderflow
+        self._format = stream_format
+        self._frame_width = sample_width * channels
+        self._silence = b'\0' * (self._period_size * self._frame_width)
+        self._stream = self._pyaudio.open(
+            format=self._pyaudio.get_format_from_width(sample_width),
+            channels=channels,
+            rate=frame_rate,
+            output=True,
+            frames_per_buffer=self._period_size,
+            stream_callback=self._callback,
+        )
+        self._latency = self._stream.get_output_latency()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """Feeds the device with next period of audio"""
+        clock = time.perf_counter()
+        size = frame_count * self._frame_width
+        if size > len(self._silence):
+            self._silence = b'\0' * size
+        with self._lock:
+            source = self._source
+            effects = self._effects
+            stats = self.stats
+        if source is None:
+            return self._silence[:size], self._continue
+        start = source.position
+        chunk = source.read(size)
+        # Periods before the first sample are measured by `first_sample`
+        starved = (
+            stats is not None and stats.first_sample is not None and
+            len(chunk) < size and not source.finished
+        )
+        if stats is not None and stats.first_sample is None and chunk:
+            ahead = 0
+            if time_info:
+                ahead = (
+                    time_info.get('output_buffer_dac_time', 0) -
+                    time_info.get('current_time', 0)
+                )
+            stats.first(ahead if ahead > 0 else self._latency)
+        if effects is not None:
+            chunk = effects.process(chunk)
+        if len(chunk) < size:
+            chunk = b''.join([chunk, self._silence[:size - len(chunk)]])
+        position = start // self._frame_width * 1000 // self._format[2]
+        with self._lock:
+            # Player could be stopped (or started again) in the meantime, so
+            # position of the previous track mustn't be published anymore
+            if self._source is source:
+                self.position = position
+                if source.finished:
+                    self._source = None
+                    self.error = source.error
+        if stats is not None:
+            stats.update(
+                time.perf_counter() - clock,
+                bool(status & self._underflow),
+                starved,
+                source.fill(),
+            )
+        return chunk, self._continue
+
+
+def play(segment, effects=None, started=None):
     """Plays segment using global player
 
-    If another song is being played, it's stopped (and its player is
-    destroyed).
+    If another song is being played, it's stopped first.
     """
-    global _CURRENT_SONG_PLAYER
-    stop()
-    _CURRENT_SONG_PLAYER = PyaudioPlayer(segment, notifier)
-    _CURRENT_SONG_PLAYER.start()
+    global _PLAYER
+    if _PLAYER is None:
+        _PLAYER = PyaudioPlayer()
+    _PLAYER.play(segment, effects, started)
+
+
+def play_blocks(blocks, stream_format, effects=None, started=None):
+    """Plays raw PCM blocks using global player, as they are rendered"""
+    global _PLAYER
+    if _PLAYER is None:
+        _PLAYER = PyaudioPlayer()
+    _PLAYER.play_blocks(blocks, stream_format, effects, started)
+
+
+def position():
+    """Returns position of the song being played in ms, None if there's none"""
+    if _PLAYER:
+        return _PLAYER.position
+    return None
+
+
+def take_error():
+    """Returns error which stopped the last song, reporting it only once"""
+    if _PLAYER is None or _PLAYER.error is None:
+        return None
+    error, _PLAYER.error = _PLAYER.error, None
+    return error
+
+
+def stats():
+    """Returns health stats of the last playback, None if there was none"""
+    if _PLAYER:
+        return _PLAYER.stats
+    return None
 
 
 def stop():
-    """Stops playing current song and destroys the player."""
-    global _CURRENT_SONG_PLAYER
-    if _CURRENT_SONG_PLAYER:
-        _CURRENT_SONG_PLAYER.stop()
-        _CURRENT_SONG_PLAYER = None
+    """Stops playing current song"""
+    if _PLAYER:
+        _PLAYER.stop()
+
 
+def close():
+    """Stops playing and releases the audio device"""
+    global _PLAYER
+    if _PLAYER:
+        _PLAYER.close()
+        _PLAYER = None
 
-def load(filename):
+
+def load(filename, start=None, length=None):
     """Loads a track based on path
 
+    If `start` and `length` (in ms) are passed, only that part of the track is
+    loaded - and, unless whole track is already cached, only that part gets
+    decoded.
+    Decoded tracks are cached, so loading the same file again is fast.
     Note: only MP3 supported right now.
     """
-    return pydub.AudioSegment.from_mp3(filename)
+    with timing.stage('load') as info:
+        segment = cache.get(filename)
+        if segment is not None:
+            if start is not None:
+                segment = view(segment, start, start + length)
+        elif start is not None:
+            segment = _decode_part(filename, start, length)
+        else:
+            segment = pydub.AudioSegment.from_mp3(filename)
+            cache.put(filename, segment)
+        info['bytes'] = len(segment._data)
+    return segment
+
+
+def _decode_part(filename, start, length):
+    """Decodes only part of the track, seeking in the decoder"""
+    info = MP3(filename).info
+    channels = 1 if info.mode == MONO else 2
+    decode_start = max(start - DECODE_MARGIN, 0)
+    command = [
+        pydub.AudioSegment.converter,
+        '-v', 'quiet',
+        '-ss', '{:.3f}'.format(decode_start / 1000),
+        '-i', filename,
+        '-t', '{:.3f}'.format((length + 2 * DECODE_MARGIN) / 1000),
+        '-f', 's16le',
+        '-ar', str(info.sample_rate),
+        '-ac', str(channels),
+        '-',
+    ]
+    data = subprocess.check_output(command, stdin=subprocess.DEVNULL)
+    segment = pydub.AudioSegment(
+        data,
+        metadata={
+            'sample_width': 2,
+            'frame_rate': info.sample_rate,
+            'frame_width': 2 * channels,
+            'channels': channels,
+        },
+    )
+    offset = start - decode_start
+    return view(segment, offset, offset + length)
+
+
+def load_cut(filename, length=None, min_start=None, max_start=None,
+             rng=None):
+    """Loads randomly selected part of the track
+
+    Works just like `load` followed by `cut`, but only the selected part is
+    decoded, so it's fast even for full length tracks.
+    """
+    duration = int(MP3(filename).info.length * 1000)
+    start, end = random_window(duration, length, min_start, max_start, rng)
+    return load(filename, start, end - start)
+
+
+def load_wav(filename):
+    """Loads already rendered track, see `prerender` module"""
+    with timing.stage('load') as info:
+        segment = pydub.AudioSegment.from_wav(filename)
+        info['bytes'] = len(segment._data)
+    return segment
+
+
+def to_array(segment):
+    """Returns segment's samples as NumPy array of (frames, channels) shape
+
+    24-bit segments are converted to 32-bit first, as NumPy has no matching
+    type for them.
+    """
+    if segment.sample_width not in dsp.DTYPES:
+        segment = segment.set_sample_width(4)
+    return dsp.to_array(segment._data, segment.sample_width, segment.channels)
+
+
+def _output(segment, shape, overrides=None):
+    """Returns buffer for samples of new segment, along with its metadata
+
+    Buffers are taken from the pool, and returned to it as soon as the new
+    segment (and everything referring to its data) is gone.
+    """
+    metadata = {}
+    if segment.sample_width not in dsp.DTYPES:
+        metadata['sample_width'] = 4
+        metadata['frame_width'] = 4 * segment.channels
+    metadata.update(overrides or {})
+    sample_width = metadata.get('sample_width', segment.sample_width)
+    return _POOL.acquire(shape, dsp.DTYPES[sample_width]), metadata
+
+
+def _wrap(segment, samples, metadata):
+    """Creates new segment, with data stored in given array"""
+    return segment._spawn(memoryview(samples).cast('B'), metadata)
+
+
+def from_array(segment, samples, overrides=None):
+    """Creates new segment from samples, using metadata of given segment"""
+    out, metadata = _output(segment, samples.shape, overrides)
+    return _wrap(segment, dsp.store(samples, out), metadata)
+
+
+def view(segment, start=0, end=None):
+    """Returns part of the segment, between `start` and `end` ms
+
+    Unlike slicing, data isn't copied. Also, the result is never padded with
+    silence, it's just shorter if segment is too short.
+    """
+    frames = int(segment.frame_count())
+    first = min(int(segment.frame_count(ms=start)), frames)
+    last = frames
+    if end is not None:
+        last = max(min(int(segment.frame_count(ms=end)), frames), first)
+    data = memoryview(segment._data).cast('B')
+    return segment._spawn(
+        data[first * segment.frame_width:last * segment.frame_width],
+    )
 
 
 def speed_up(segment, speed):
-    """Speeds up the track, while keeping the same length
+    """Speeds up the track, while keeping the same pitch
 
-    Note: pydub's speedup is SLOW.
+    Uses WSOLA time-stretching, so it's fast enough to be used live.
     """
     if speed <= 1:
         raise ValueError('speed must not be lower than 1')
-    return segment.speedup(playback_speed=speed, chunk_size=80, crossfade=5)
+    samples = dsp.time_stretch(to_array(segment), speed, segment.frame_rate)
+    return from_array(segment, samples)
 
 
 def reverse(segment):
     """Reverses the track"""
-    return segment.reverse()
+    samples = to_array(segment)
+    out, metadata = _output(segment, samples.shape)
+    out[...] = samples[::-1]
+    return _wrap(segment, out, metadata)
+
+
+def resample(segment, frame_rate):
+    """Changes frame rate of the segment, keeping its speed and pitch"""
+    if segment.frame_rate == frame_rate:
+        return segment
+    samples = to_array(segment)
+    out, metadata = _output(
+        segment,
+        (
+            dsp.resampled_length(len(samples), segment.frame_rate, frame_rate),
+            samples.shape[1],
+        ),
+        {'frame_rate': frame_rate},
+    )
+    out = dsp.resample(samples, segment.frame_rate, frame_rate, out)
+    return _wrap(segment, out, metadata)
 
 
 def frequency(segment, frequency):
@@ -105,28 +535,41 @@ def frequency(segment, frequency):
 
     Lower frequency worsenes the quality.
     """
-    return segment.set_frame_rate(frequency)
+    return resample(segment, frequency)
 
 
-def volume_changer(segment, slice_length=250):
+def volume_changer(segment, slice_length=250, ramp_length=0):
     """Changes volume of the track on set interval
 
     The track becomes something like this:
     H L H L H L H L...
     where H means high volume, and L stands for low (reduced) volume.
+    `ramp_length` (in ms) smooths out volume changes at slices' edges.
     """
-    # Split segment into equally sized slices
-    slices = make_chunks(segment, slice_length)
-    result = slices[0]
-    for i, s in enumerate(slices[1:]):
-        if i % 2 == 0:
-            s -= 15
-        result += s
-    return result
+    samples = to_array(segment)
+    out, metadata = _output(segment, samples.shape)
+    # Envelope is computed block by block, to avoid track-sized temporaries
+    for start in range(0, len(samples), dsp.STORE_BLOCK_FRAMES):
+        block = samples[start:start + dsp.STORE_BLOCK_FRAMES]
+        envelope = dsp.gain_envelope(
+            len(block),
+            int(slice_length * segment.frame_rate / 1000),
+            db_to_float(-VOLUME_CHANGER_DECREASE),
+            int(ramp_length * segment.frame_rate / 1000),
+            start,
+        )
+        dsp.store(
+            block * envelope,
+            out[start:start + dsp.STORE_BLOCK_FRAMES],
+        )
+    return _wrap(segment, out, metadata)
 
 
 def pitch(segment, rate):
-    """Changes the pitch, and also track's speed"""
+    """Changes the pitch, and also track's speed
+
+    Only frame rate is changed, data is shared with the original segment.
+    """
     return segment._spawn(
         segment._data,
         {'frame_rate': int(segment.frame_rate*rate)},
@@ -136,50 +579,107 @@ def pitch(segment, rate):
 def tone_down(segment, rate):
     """Lowers track's tone while keeping the same speed
 
-    Basically does the same thing as pitch, but retains the speed.
-    Note: pydub's speedup is SLOW.
+    Basically does the same thing as pitch, but retains the speed: the track
+    is time-compressed first, so that it has original length after pitching.
     """
-    result = segment._spawn(
-        segment._data,
+    samples = dsp.time_stretch(to_array(segment), 1/rate, segment.frame_rate)
+    return from_array(
+        segment,
+        samples,
         {'frame_rate': int(segment.frame_rate*rate)},
     )
-    return result.speedup(
-        playback_speed=round(1/rate, 2),
-        chunk_size=80,
-        crossfade=5,
-    )
 
 
-def mix_segments(segments, slice_length=500):
+def convert(segment, frame_rate, channels, sample_width):
+    """Converts segment to given format, if it's not already in it"""
+    segment = resample(segment, frame_rate)
+    if segment.channels != channels:
+        segment = segment.set_channels(channels)
+    if segment.sample_width != sample_width:
+        segment = segment.set_sample_width(sample_width)
+    return segment
+
+
+def match_formats(segments):
+    """Converts segments to common frame rate, channels and sample width
+
+    Just like pydub does when adding segments, the highest value of each
+    parameter wins. Segments already in proper format are returned as they are.
+    """
+    frame_rate = max(segment.frame_rate for segment in segments)
+    channels = max(segment.channels for segment in segments)
+    sample_width = max(segment.sample_width for segment in segments)
+    return [
+        convert(segment, frame_rate, channels, sample_width)
+        for segment in segments
+    ]
+
+
+def mix_segments(segments, slice_length=500, loop=False, gains=None):
     """Mixes two tracks together
 
     Given two tracks 1 and 2, output becomes something like this:
     1 2 1 2 1 2 1 2...
+    Output is as long as the shortest track - or, if `loop` is set, as long as
+    the first one, with other tracks looped when they're too short.
+    Optional `gains` (in dB, one for each track) are applied only to the
+    slices that are actually used.
+    Output buffer is allocated once, and every slice is copied straight into
+    its place.
     """
+    segments = match_formats(segments)
     segments_count = len(segments)
-    # Cut to the shortest segment
-    shortest_length = min(len(segment) for segment in segments)
-    segments = [segment[:shortest_length] for segment in segments]
-    slices = [make_chunks(segment, slice_length) for segment in segments]
-    first = slices[0][0]
-    for i, s in enumerate(slices[0][1:], start=1):
-        first += slices[i % segments_count][i]
-    return first
+    sources = [to_array(segment) for segment in segments]
+    if loop:
+        length = len(sources[0])
+    else:
+        length = min(len(source) for source in sources)
+    gains = [db_to_float(gain) for gain in gains or [0] * segments_count]
+    slice_frames = int(slice_length * segments[0].frame_rate / 1000)
+    result, metadata = _output(
+        segments[0],
+        (length, sources[0].shape[1]),
+    )
+    for i, start in enumerate(range(0, length, slice_frames)):
+        dsp.copy_looped(
+            result[start:start + slice_frames],
+            sources[i % segments_count],
+            start,
+            gains[i % segments_count],
+        )
+    return _wrap(segments[0], result, metadata)
 
 
-def cut(segment, length=None, min_start=None, max_start=None):
-    """Selects random sample from the segment"""
+def random_window(segment_length, length=None, min_start=None,
+                  max_start=None, rng=None):
+    """Returns random (start, end) of part of the track, in ms
+
+    `rng` is random generator to use, global one by default.
+    """
     if not length:
         length = SEGMENT_LENGTH_SECONDS * 1000
-    start = random.randint(
+    start = (rng or random).randint(
         min_start if min_start is not None else MINIMUM_STARTING_POINT * 1000,
         max_start if max_start is not None else MAXIMUM_STARTING_POINT * 1000,
     )
     end = start + length
-    if len(segment) < end:  # segment is too short?
-        end = len(segment) - 1
-        start = end - length
-    return segment[start:end]
+    if segment_length < end:  # segment is too short?
+        end = segment_length - 1
+        start = max(end - length, 0)
+    return start, end
+
+
+def cut(segment, length=None, min_start=None, max_start=None, rng=None):
+    """Selects random sample from the segment"""
+    with timing.stage('cut', len(segment._data)):
+        start, end = random_window(
+            len(segment),
+            length,
+            min_start,
+            max_start,
+            rng,
+        )
+        return view(segment, start, end)
 
 
 def get_info(filename):
@@ -195,9 +695,62 @@ def get_info(filename):
     )
 
 
-def overlay(tracks):
-    """Mixes multiple tracks together by layering one onto another"""
-    main_track = tracks[0]
-    for track in tracks[1:]:
-        main_track = main_track.overlay(track, loop=True)
-    return main_track
+def overlay(tracks, gains=None):
+    """Mixes multiple tracks together by layering one onto another
+
+    All layers are summed block by block, in wide accumulator, and the
+    result is saturated only once at the end. Output is as long as the first
+    track, other ones are looped if they're too short.
+    Optional `gains` (in dB, one for each track) are applied on the way.
+    """
+    tracks = match_formats(tracks)
+    gains = [db_to_float(gain) for gain in gains or [0] * len(tracks)]
+    sources = [to_array(track) for track in tracks]
+    out, metadata = _output(tracks[0], sources[0].shape)
+    dtype = numpy.float64 if sources[0].itemsize > 2 else numpy.float32
+    for start in range(0, len(out), dsp.STORE_BLOCK_FRAMES):
+        accumulator = numpy.zeros(
+            out[start:start + dsp.STORE_BLOCK_FRAMES].shape,
+            dtype=dtype,
+        )
+        for source, gain in zip(sources, gains):
+            if len(source):
+                dsp.add_looped(accumulator, source, gain, start)
+        dsp.store(accumulator, out[start:start + dsp.STORE_BLOCK_FRAMES])
+    return _wrap(tracks[0], out, metadata)
+
+
+def block_peaks(segment):
+    """Returns peaks of consecutive blocks of the segment
+
+    Blocks are `dsp.STORE_BLOCK_FRAMES` long. Peaks are computed once for
+    every segment, and remembered for as long as the segment lives.
+    """
+    key = id(segment)
+    if key not in _PEAKS:
+        _PEAKS[key] = dsp.block_peaks(to_array(segment))
+        weakref.finalize(segment, _PEAKS.pop, key, None)
+    return _PEAKS[key]
+
+
+def peak(segment, start=0, end=None):
+    """Returns peak (maximum absolute sample value) of the segment
+
+    Only part between `start` and `end` ms is taken into account. Peaks of
+    blocks lying inside it are reused, so only the edges are scanned.
+    """
+    samples = to_array(segment)
+    first = min(int(segment.frame_count(ms=start)), len(samples))
+    last = len(samples)
+    if end is not None:
+        last = max(min(int(segment.frame_count(ms=end)), last), first)
+    size = dsp.STORE_BLOCK_FRAMES
+    first_block = -(-first // size)
+    last_block = last // size
+    if first_block >= last_block:
+        return dsp.peak(samples[first:last])
+    return max(
+        int(block_peaks(segment)[first_block:last_block].max()),
+        dsp.peak(samples[first:first_block * size]),
+        dsp.peak(samples[last_block * size:last]),
+    )
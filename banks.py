@@ -0,0 +1,120 @@
+"""Sample banks used by panzerfaust and overlay filters
+
+Only list of files is read at startup. Tracks are loaded when they're used for
+the first time (straight from the cache, if they were decoded before), and
+converted once to the format of contest tracks they're mixed with, so that
+they don't need to be converted every time.
+"""
+from collections import OrderedDict
+import os
+import os.path
+import random
+import threading
+
+import audio
+import cache
+import config
+
+
+FORMATS_KEPT = 2  # tracks converted to other formats are dropped
+
+
+def default_format():
+    """Returns format from the config, (frame rate, channels, sample width)"""
+    return (
+        config.BANK_FRAME_RATE,
+        config.BANK_CHANNELS,
+        config.BANK_SAMPLE_WIDTH,
+    )
+
+
+class SampleBank(object):
+    """Lazily loaded collection of tracks from single directory
+
+    Formats are tuples of (frame rate, channels, sample width), just like
+    `stream.Format`. Tracks converted to only a few recently used formats are
+    kept, as formats of streams change with the filters applied.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.filenames = []
+        self._sources = {}
+        self._formats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def index(self):
+        """Lists tracks available in the bank, without loading them"""
+        if not os.path.exists(self.path):
+            self.filenames = []
+            return
+        self.filenames = sorted(
+            os.path.join(self.path, filename)
+            for filename in os.listdir(self.path)
+            if filename.endswith('.mp3')
+        )
+
+    def get(self, i, track_format=None):
+        """Returns i-th track in given format, loading it if needed
+
+        Format from the config is used by default.
+        """
+        filename = self.filenames[i]
+        track_format = tuple(track_format or default_format())
+        with self._lock:
+            track = self._formats.get(track_format, {}).get(filename)
+            if track is not None:
+                self._formats.move_to_end(track_format)
+            source = self._sources.get(filename)
+        if track is None:
+            if source is None:
+                source = audio.load(filename)
+            track = audio.convert(source, *track_format)
+            # Peaks are used for mixing, so they're computed right away
+            audio.block_peaks(track)
+            self._keep(filename, track_format, track)
+        return track
+
+    def add(self, filename, track):
+        """Adds already loaded track to the bank"""
+        with self._lock:
+            self.filenames.append(filename)
+            self._sources[filename] = track
+        track_format = (track.frame_rate, track.channels, track.sample_width)
+        self._keep(filename, track_format, track)
+
+    def choice(self, rng=None, track_format=None):
+        """Returns random track from the bank, in given format"""
+        return self.get(
+            (rng or random).randrange(len(self.filenames)),
+            track_format,
+        )
+
+    def _keep(self, filename, track_format, track):
+        """Remembers converted track, forgetting least recent formats"""
+        with self._lock:
+            tracks = self._formats.pop(track_format, {})
+            tracks[filename] = track
+            self._formats[track_format] = tracks
+            while len(self._formats) > FORMATS_KEPT:
+                self._formats.popitem(last=False)
+
+    def warm(self, progress=None):
+        """Decodes tracks missing from the cache, so they load fast when needed
+
+        Tracks aren't kept in memory, they're still loaded lazily. `progress`
+        is called with number of the track and total count before decoding
+        each one.
+        """
+        if not config.CACHE_ENABLED:
+            return
+        missing = [
+            filename for filename in list(self.filenames)
+            if cache.get(filename) is None
+        ]
+        for i, filename in enumerate(missing, start=1):
+            if progress:
+                progress(i, len(missing))
+            audio.load(filename)
@@ -0,0 +1,254 @@
+"""Benchmark of filters and audio primitives
+
+Runs every filter (and every combination of filters that can be selected
+together) on synthetic tracks in a few common formats, both rendering whole
+track and streaming it block by block, and reports how many times faster
+than realtime they are, along with peak memory usage. Results are saved as
+JSON, so they can be compared between machines.
+
+    python benchmark.py --output results.json
+"""
+from datetime import datetime
+import argparse
+import gc
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy
+import pydub
+
+import audio
+import filters
+
+
+FORMATS = {
+    '44k-mono': (44100, 1),
+    '44k-stereo': (44100, 2),
+    '48k-mono': (48000, 1),
+    '48k-stereo': (48000, 2),
+}
+LENGTHS = {
+    'half': 35,  # what is being heard during the contest
+    'cut': 70,  # what is being loaded when tracks are already cut
+    'full': 240,  # what is being loaded when they're not
+}
+BANK_TRACK_LENGTH = 20  # in seconds
+
+
+def synthetic_track(frame_rate, channels, length):
+    """Generates 16-bit track: few sine waves with some noise, `length` s"""
+    generator = numpy.random.RandomState(0)
+    time_axis = numpy.arange(int(frame_rate * length)) / frame_rate
+    samples = numpy.zeros_like(time_axis)
+    for frequency in (110, 440, 1250):
+        samples += numpy.sin(2 * numpy.pi * frequency * time_axis) * 5000
+    samples += generator.normal(0, 1000, len(samples))
+    samples = numpy.repeat(samples[:, numpy.newaxis], channels, axis=1)
+    return pydub.AudioSegment(
+        samples.astype(numpy.int16).tobytes(),
+        metadata={
+            'sample_width': 2,
+            'frame_rate': frame_rate,
+            'frame_width': 2 * channels,
+            'channels': channels,
+        },
+    )
+
+
+def measure(function, duration, repeat):
+    """Runs function `repeat` times, returns best time and peak memory
+
+    Tracing memory slows down allocations a lot, so memory is measured in
+    separate run.
+    """
+    times = []
+    for _ in range(repeat):
+        random.seed(0)
+        gc.collect()
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    random.seed(0)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = min(times)
+    return {
+        'seconds': best,
+        'realtime_factor': duration / best if best else None,
+        'peak_memory': peak,
+    }
+
+
+def primitives(track):
+    """Returns audio primitives to benchmark, as name: function pairs"""
+    other = track.reverse()
+    return {
+        'audio.cut': lambda: audio.cut(track, len(track) // 2, 0, 0),
+        'audio.reverse': lambda: audio.reverse(track),
+        'audio.pitch': lambda: audio.pitch(track, 1.5),
+        'audio.speed_up': lambda: audio.speed_up(track, 1.5),
+        'audio.tone_down': lambda: audio.tone_down(track, 0.7),
+        'audio.frequency': lambda: audio.frequency(track, 8000),
+        'audio.volume_changer': lambda: audio.volume_changer(track, 250),
+        'audio.mix_segments': lambda: audio.mix_segments(
+            [track, other, track],
+            2000,
+        ),
+        'audio.overlay': lambda: audio.overlay([track, other]),
+    }
+
+
+def stream(track, filters_list, length):
+    """Renders the track block by block, like the player does"""
+    _, blocks = filters.apply_blocks(track, filters_list, length)
+    for _ in blocks:
+        pass
+
+
+def combinations(max_size):
+    """Yields all combinations of filters that can be selected together"""
+    names = filters.FILTERS_LIST
+    for size in range(1, max_size + 1):
+        for combination in itertools.combinations(names, size):
+            if any(
+                other in combination
+                for name in combination
+                for other in filters.DONT_LIKE_EACH_OTHER[name]
+            ):
+                continue
+            yield combination
+
+
+def prepare_banks(frame_rate, channels):
+    """Fills panzerfaust and overlay banks with synthetic tracks"""
+    for bank in (filters.PANZER_BANK, filters.OVERLAY_BANK):
+        bank.filenames = []
+        bank.add(
+            'synthetic',
+            synthetic_track(frame_rate, channels, BANK_TRACK_LENGTH),
+        )
+
+
+def run(formats, lengths, max_combination, repeat, log=None):
+    """Runs the benchmark, returns list of results"""
+    results = []
+    for format_name in formats:
+        frame_rate, channels = FORMATS[format_name]
+        prepare_banks(frame_rate, channels)
+        for length_name in lengths:
+            length = LENGTHS[length_name]
+            track = synthetic_track(frame_rate, channels, length)
+            cases = [
+                (name, function, length)
+                for name, function in sorted(primitives(track).items())
+            ]
+            # Filters render only half of the track, see filters.apply
+            output_length = length * 1000 // 2
+            for combination in combinations(max_combination):
+                cases.append((
+                    'filters: ' + ' + '.join(combination),
+                    lambda c=combination: filters.apply(
+                        track,
+                        list(c),
+                        output_length,
+                    ),
+                    output_length / 1000,
+                ))
+                cases.append((
+                    'stream: ' + ' + '.join(combination),
+                    lambda c=combination: stream(
+                        track,
+                        list(c),
+                        output_length,
+                    ),
+                    output_length / 1000,
+                ))
+            for name, function, duration in cases:
+                result = measure(function, duration, repeat)
+                result.update({
+                    'name': name,
+                    'format': format_name,
+                    'length': length_name,
+                })
+                results.append(result)
+                if log:
+                    log(result)
+    return results
+
+
+def print_result(result):
+    sys.stdout.write(
+        '{format:>10} {length:>4} {name:<48} {factor:>8.1f}x '
+        '{memory:>8.1f} MB\n'.format(
+            format=result['format'],
+            length=result['length'],
+            name=result['name'],
+            factor=result['realtime_factor'] or 0,
+            memory=result['peak_memory'] / 1024 ** 2,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--output',
+        default='benchmark.json',
+        help='where to save the results (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--formats',
+        nargs='+',
+        choices=sorted(FORMATS),
+        default=sorted(FORMATS),
+    )
+    parser.add_argument(
+        '--lengths',
+        nargs='+',
+        choices=sorted(LENGTHS),
+        default=sorted(LENGTHS),
+    )
+    parser.add_argument(
+        '--combinations',
+        type=int,
+        default=3,
+        help='maximum number of filters combined (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='how many times each case is run (default: %(default)s)',
+    )
+    args = parser.parse_args()
+    results = run(
+        args.formats,
+        args.lengths,
+        args.combinations,
+        args.repeat,
+        log=print_result,
+    )
+    with open(args.output, 'w') as f:
+        json.dump({
+            'date': datetime.now().isoformat(),
+            'machine': {
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'python': platform.python_version(),
+                'numpy': numpy.__version__,
+            },
+            'results': results,
+        }, f, indent=2)
+    print('Results saved to {output}.'.format(output=args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Persistent cache of decoded tracks
+
+Decoding MP3 files is slow, so raw PCM data of every loaded track is stored on
+disk, keyed by track's path, size and modification time. Cached tracks are
+memory-mapped instead of being read, so loading them again is almost free.
+
+Can be run in order to pre-warm the cache for whole directory (along with
+panzerfaust and overlay directories):
+
+    python cache.py
+"""
+import hashlib
+import json
+import mmap
+import os
+import os.path
+import sys
+import tempfile
+
+import pydub
+
+import config
+
+
+def _key(filename):
+    """Returns cache key for given file"""
+    stat = os.stat(filename)
+    raw = '{path}:{size}:{mtime}'.format(
+        path=os.path.abspath(filename),
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+    )
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _paths(key):
+    """Returns paths of data and metadata files for given key"""
+    path = os.path.join(config.CACHE_PATH, key)
+    return path + '.pcm', path + '.json'
+
+
+def get(filename):
+    """Returns cached track, or None if it's not in the cache"""
+    if not config.CACHE_ENABLED:
+        return None
+    data_path, metadata_path = _paths(_key(filename))
+    try:
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        with open(data_path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Mark as recently used
+        os.utime(data_path, None)
+    except (IOError, OSError, ValueError):
+        return None
+    return pydub.AudioSegment(data, metadata=metadata)
+
+
+def put(filename, segment):
+    """Stores decoded track in the cache"""
+    if not config.CACHE_ENABLED:
+        return
+    os.makedirs(config.CACHE_PATH, exist_ok=True)
+    data_path, metadata_path = _paths(_key(filename))
+    # Write to temporary files first, so that no one sees half-written data.
+    # Other processes may be storing the same track at the same time, so
+    # every writer has its own files - whichever is replaced last wins, and
+    # they're the same anyway.
+    data_temp = _write_temp(lambda f: f.write(segment._data))
+    metadata_temp = _write_temp(lambda f: f.write(json.dumps({
+        'sample_width': segment.sample_width,
+        'frame_rate': segment.frame_rate,
+        'frame_width': segment.frame_width,
+        'channels': segment.channels,
+    }).encode('utf-8')))
+    os.replace(metadata_temp, metadata_path)
+    os.replace(data_temp, data_path)
+    evict()
+
+
+def _write_temp(write):
+    """Writes new temporary file in the cache directory, returns its path"""
+    fd, path = tempfile.mkstemp(dir=config.CACHE_PATH, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def evict(limit=None):
+    """Removes least recently used tracks until cache fits in the limit"""
+    if limit is None:
+        limit = config.CACHE_SIZE_LIMIT
+    entries = []
+    for filename in os.listdir(config.CACHE_PATH):
+        if not filename.endswith('.pcm'):
+            continue
+        try:
+            stat = os.stat(os.path.join(config.CACHE_PATH, filename))
+        except OSError:
+            continue  # evicted by another process in the meantime
+        entries.append((stat.st_mtime, stat.st_size, filename[:-4]))
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total <= limit:
+            break
+        for path in _paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+
+def warm(directory):
+    """Decodes all tracks from given directory, so that they're cached"""
+    import audio
+    import utils
+    filenames = utils.get_filenames(directory)
+    for i, filename in enumerate(filenames.values(), start=1):
+        sys.stdout.write(
+            '\rCaching file {i}/{total}... [{filename}]\033[K'.format(
+                i=i,
+                total=len(filenames),
+                filename=os.path.basename(filename),
+            ),
+        )
+        sys.stdout.flush()
+        audio.load(filename)
+    print()
+
+
+if __name__ == '__main__':
+    warm(input('Directory to cache (will be read recursively): '))
+    import filters
+    for bank in (filters.PANZER_BANK, filters.OVERLAY_BANK):
+        if os.path.exists(bank.path):
+            warm(bank.path)
+    print('Done.')
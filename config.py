@@ -24,3 +24,61 @@ LOAD_TRIPLE_THRESHOLD = 0.15  # *= LOAD_MULTIPLE_THRESHOLD
 # How many points to award?
 FILTER_POINTS = (2, 3, 5, 7)
 TRACKS_MULTIPLIER = (1, 1, 2.4, 3.6)
+
+# Decoded tracks cache
+CACHE_ENABLED = True
+CACHE_PATH = '.cache'
+CACHE_SIZE_LIMIT = 4 * 1024 ** 3  # in bytes
+
+# Prefetching of upcoming tracks
+PREFETCH_COUNT = 3
+PREFETCH_WORKERS = 2
+PREFETCH_MEMORY_BUDGET = 512 * 1024 ** 2  # in bytes
+LOAD_WORKERS = 3  # for tracks that are needed right away
+
+# Loading and rendering in separate processes, so that they don't hold up
+# the interface and the player. Jobs needed right away have LOAD_WORKERS
+# processes of their own.
+RENDER_WORKER = True
+RENDER_WORKERS = 2  # for prefetching and speculative rendering
+
+# Track-sized buffers kept for reuse by filters
+BUFFER_POOL_SIZE = 4
+
+# Playback
+PLAYER_PERIOD_SIZE = 512  # in frames, smaller means lower latency
+
+# Interface
+# How often (in tenths of second) position and notifications from background
+# threads are drawn, when no key is pressed
+UI_REFRESH = 1
+
+# Streaming
+STREAMING = True  # start playing before whole track is rendered
+BLOCK_LENGTH = 100  # in ms
+STREAM_QUEUE_BLOCKS = 10  # how many blocks are rendered ahead
+# Filters that work block by block are applied by the player, so they can be
+# switched on and off while playing
+REALTIME_FILTERS = True
+
+# Default format of panzerfaust and overlay tracks, should match the contest
+# tracks (otherwise they're converted to format of every track they're mixed
+# with)
+BANK_FRAME_RATE = 44100
+BANK_CHANNELS = 2
+BANK_SAMPLE_WIDTH = 2
+
+# Library index, kept in tracks directory
+LIBRARY_FILENAME = '.ekoie.sqlite'
+
+# Timing of loading, mixing, filtering and playback
+TIMING_ENABLED = True
+TIMING_LOG = 'timing.jsonl'
+
+# Playback health (underruns, callback time, buffer fill), measured while
+# playing and saved to separate file every session - or neither, if disabled
+HEALTH_ENABLED = True
+HEALTH_LOG = 'playback-{session}.jsonl'
+
+# Startup
+STARTUP_TARGET = 0.5  # in seconds, until settings screen is displayed
@@ -1,10 +1,15 @@
 """Track cutter utility
 
 Used for cutting tracks to proper size.
+Files are converted in parallel, and the ones that are already converted are
+skipped, so interrupted conversion can be simply run again. Files that can't
+be converted are reported and skipped, too.
 """
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import os
 import os.path
-import sys
+import time
 
 from mutagen.easyid3 import EasyID3
 
@@ -12,39 +17,137 @@ import audio
 import utils
 
 
-def pretty_print(msg):
-    sys.stdout.write('\r{msg}\033[K'.format(msg=msg))
+MANIFEST_FILENAME = '.cutter.json'
 
 
-input_dir = input('Input directory (will be read recursively): ')
-output_dir = input(
-    'Output directory (will be created if not present): [./tracks]'
-) or './tracks'
-length = input('Track length, in seconds: [70] ') or 70
-length = int(length)
+def is_up_to_date(filename, new_filename, length, manifest):
+    """Checks whether file was already converted with the same parameters"""
+    entry = manifest.get(os.path.basename(new_filename))
+    if not entry or not os.path.exists(new_filename):
+        return False
+    return (
+        entry['source'] == os.path.abspath(filename) and
+        entry['length'] == length and
+        entry['mtime'] == os.path.getmtime(filename) and
+        os.path.getmtime(new_filename) >= os.path.getmtime(filename)
+    )
 
-if not os.path.exists(output_dir):
-    os.mkdir(output_dir)
 
-filenames = utils.get_filenames(input_dir)
-filenames_length = len(filenames)
-for i, filename in enumerate(filenames.values(), start=1):
-    pretty_print(
-        'Converting file {i}/{total}... [{filename}]'.format(
-            i=i,
-            total=filenames_length,
-            filename=os.path.basename(filename),
-        ),
-    )
-    track = audio.load(filename)
-    track = audio.cut(track, length * 1000)
-    new_filename = os.path.join(
-        output_dir,
-        os.path.basename(filename),
+def output_filenames(input_dir, filenames, output_dir):
+    """Returns dictionary mapping input files to output files
+
+    Output directory is flat, so files with the same name from different
+    directories get their relative path in the name.
+    """
+    names = {}
+    for filename in filenames:
+        name = os.path.basename(filename)
+        names.setdefault(name, []).append(filename)
+    result = {}
+    for name, same_name in names.items():
+        for filename in same_name:
+            if len(same_name) > 1:
+                relative = os.path.relpath(filename, input_dir)
+                name = relative.replace(os.sep, ' - ')
+            result[filename] = os.path.join(output_dir, name)
+    return result
+
+
+def convert(filename, new_filename, length):
+    """Cuts single file and saves it, along with metadata
+
+    Output is written to temporary file first, so that interrupted conversion
+    doesn't leave broken files behind.
+    """
+    temp_filename = os.path.join(
+        os.path.dirname(new_filename),
+        '.{name}.part'.format(name=os.path.basename(new_filename)),
     )
-    track.export(new_filename, format='mp3', bitrate='256k')
+    track = audio.load_cut(filename, length * 1000)
+    track.export(temp_filename, format='mp3', bitrate='256k')
     # Copy metadata, too
     data = EasyID3(filename)
-    data.save(new_filename, v1=2)
-print()
-print('Done.')
+    data.save(temp_filename, v1=2)
+    os.replace(temp_filename, new_filename)
+    return filename
+
+
+def main():
+    input_dir = input('Input directory (will be read recursively): ')
+    output_dir = input(
+        'Output directory (will be created if not present): [./tracks]'
+    ) or './tracks'
+    length = input('Track length, in seconds: [70] ') or 70
+    length = int(length)
+    workers = input(
+        'Number of workers: [{count}] '.format(
+            count=multiprocessing.cpu_count(),
+        )
+    ) or multiprocessing.cpu_count()
+    workers = int(workers)
+
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    manifest = utils.load_manifest(output_dir, MANIFEST_FILENAME, {})
+    jobs = {}
+    skipped = 0
+    outputs = output_filenames(
+        input_dir,
+        utils.get_filenames(input_dir).values(),
+        output_dir,
+    )
+    for filename, new_filename in outputs.items():
+        if is_up_to_date(filename, new_filename, length, manifest):
+            skipped += 1
+        else:
+            jobs[filename] = new_filename
+    if skipped:
+        print('Skipping {count} already converted files.'.format(
+            count=skipped,
+        ))
+
+    started = time.time()
+    failed = 0
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(convert, filename, new_filename, length): filename
+            for filename, new_filename in jobs.items()
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            filename = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                utils.pretty_print(
+                    'Failed to convert {filename}: {error}\n'.format(
+                        filename=filename,
+                        error=e,
+                    ),
+                )
+                continue
+            manifest[os.path.basename(jobs[filename])] = {
+                'source': os.path.abspath(filename),
+                'mtime': os.path.getmtime(filename),
+                'length': length,
+            }
+            utils.save_manifest(output_dir, MANIFEST_FILENAME, manifest)
+            per_minute = i / (time.time() - started) * 60
+            utils.pretty_print(
+                'Converted file {i}/{total} ({speed:.1f} files/min) '
+                '[{filename}]'.format(
+                    i=i,
+                    total=len(jobs),
+                    speed=per_minute,
+                    filename=os.path.basename(filename),
+                ),
+            )
+    print()
+    if failed:
+        print('{count} files failed to convert.'.format(count=failed))
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
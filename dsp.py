@@ -0,0 +1,415 @@
+"""Low-level DSP routines working on raw PCM
+
+Everything here operates on NumPy arrays shaped (frames, channels), so it
+doesn't need to know anything about pydub. `audio` module is responsible for
+converting AudioSegments to arrays and back.
+"""
+from fractions import Fraction
+import functools
+import threading
+import weakref
+
+import numpy
+
+
+# pydub (and audioop) treat all sample widths as signed integers
+DTYPES = {
+    1: numpy.int8,
+    2: numpy.int16,
+    4: numpy.int32,
+}
+
+WSOLA_FRAME_MS = 40  # length of single analysis/synthesis frame
+WSOLA_TOLERANCE = 0.5  # search window, as a fraction of the hop size
+WSOLA_DECIMATION = 4  # similarity is computed on every n-th sample only
+WSOLA_BLOCK_FRAMES = 256  # how many frames to overlap-add at once
+
+RESAMPLER_TAPS = 16  # filter length, per single phase
+RESAMPLER_ROLLOFF = 0.95  # cutoff, as a fraction of the Nyquist frequency
+RESAMPLER_KAISER_BETA = 8.0
+RESAMPLER_BLOCK_FRAMES = 65536  # how many output frames to compute at once
+RESAMPLER_MAX_PHASES = 512  # odd ratios are approximated to keep banks small
+
+STORE_BLOCK_FRAMES = 65536  # how many frames to convert to integers at once
+POOL_GRANULARITY = 1024 ** 2  # buffer sizes are rounded up to this many bytes
+
+
+def to_array(data, sample_width, channels):
+    """Returns view of raw PCM data as array of (frames, channels) shape"""
+    samples = numpy.frombuffer(data, dtype=DTYPES[sample_width])
+    return samples.reshape(-1, channels)
+
+
+def to_bytes(samples, sample_width):
+    """Converts array of samples back into raw PCM, saturating if needed"""
+    dtype = DTYPES[sample_width]
+    if samples.dtype != dtype:
+        info = numpy.iinfo(dtype)
+        samples = numpy.clip(numpy.rint(samples), info.min, info.max)
+        samples = samples.astype(dtype)
+    return samples.tobytes()
+
+
+def store(samples, out):
+    """Writes samples into integer array, saturating if needed
+
+    Works like `to_bytes`, but the conversion is done block by block, so it
+    doesn't need any track-sized temporary arrays.
+    """
+    if samples.dtype == out.dtype:
+        out[...] = samples
+        return out
+    info = numpy.iinfo(out.dtype)
+    for start in range(0, len(samples), STORE_BLOCK_FRAMES):
+        block = numpy.rint(samples[start:start + STORE_BLOCK_FRAMES])
+        numpy.clip(block, info.min, info.max, out=block)
+        out[start:start + STORE_BLOCK_FRAMES] = block
+    return out
+
+
+class _Owner(object):
+    """Exposes beginning of pool's buffer as array of given shape and type"""
+    def __init__(self, base, shape, dtype):
+        self.base = base
+        self.__array_interface__ = {
+            'data': (base.ctypes.data, False),
+            'shape': tuple(shape),
+            'typestr': numpy.dtype(dtype).str,
+            'version': 3,
+        }
+
+
+class BufferPool(object):
+    """Pool of reusable, track-sized buffers
+
+    Every acquired array is returned to the pool as soon as it (along with
+    all of its views and memoryviews) is garbage collected, so when filters
+    are applied one after another, their outputs are written alternately into
+    the same two buffers. At most `limit` unused buffers are kept.
+    """
+    def __init__(self, limit):
+        self._limit = limit
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype):
+        """Returns uninitialized array of given shape and type"""
+        size = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+        base = None
+        with self._lock:
+            # Arrays can't be compared with ==, so they're found by index
+            fitting = [
+                (len(free), i)
+                for i, free in enumerate(self._free)
+                if len(free) >= size
+            ]
+            if fitting:
+                base = self._free.pop(min(fitting)[1])
+        if base is None:
+            base = numpy.empty(
+                -(-size // POOL_GRANULARITY) * POOL_GRANULARITY,
+                dtype=numpy.uint8,
+            )
+        # Views of the array would keep only the base buffer alive, which is
+        # never freed, so the array gets its own owner for them to refer to
+        owner = _Owner(base, shape, dtype)
+        weakref.finalize(owner, self._release, base)
+        return numpy.asarray(owner)
+
+    def _release(self, base):
+        with self._lock:
+            self._free.append(base)
+            if len(self._free) > self._limit:
+                sizes = [len(free) for free in self._free]
+                del self._free[sizes.index(min(sizes))]
+
+
+def _hann(length):
+    """Periodic Hann window, summing up to 1 when overlapped by half"""
+    return 0.5 - 0.5 * numpy.cos(
+        2 * numpy.pi * numpy.arange(length) / length,
+    )
+
+
+def _best_offsets(decimated, positions, frame, hop, tolerance):
+    """Finds WSOLA frame positions, starting from nominal ones
+
+    Each frame is moved by up to `tolerance` samples, so that it resembles
+    natural continuation of the previously chosen frame as much as possible.
+    This is the only sequential part of the algorithm, so it works on
+    mono signal decimated by WSOLA_DECIMATION to keep it cheap.
+    """
+    step = WSOLA_DECIMATION
+    frame_d = frame // step
+    hop_d = hop // step
+    tolerance_d = tolerance // step
+    chosen = numpy.empty_like(positions)
+    chosen[0] = positions[0]
+    for i in range(1, len(positions)):
+        natural = chosen[i - 1] // step + hop_d
+        target = decimated[natural:natural + frame_d]
+        start = positions[i] // step - tolerance_d
+        region = decimated[start:start + frame_d + 2 * tolerance_d]
+        similarity = numpy.correlate(region, target, mode='valid')
+        chosen[i] = (start + int(numpy.argmax(similarity))) * step
+    return chosen
+
+
+def time_stretch(samples, speed, frame_rate):
+    """Changes duration of the samples by `speed`, keeping the pitch
+
+    Uses WSOLA (Waveform Similarity Overlap-Add): output is built from
+    Hann-windowed frames taken from the input every `hop * speed` samples,
+    each one shifted slightly to keep the waveform continuous.
+    Returns float array, roughly `len(samples) / speed` frames long.
+    """
+    frame = int(frame_rate * WSOLA_FRAME_MS / 1000) // 2 * 2
+    hop = frame // 2
+    tolerance = int(hop * WSOLA_TOLERANCE)
+    length = samples.shape[0]
+    out_length = int(round(length / speed))
+    count = out_length // hop + 1
+    # Pad input, so that every frame (and its search region) fits in
+    padding = tolerance + frame
+    padded = numpy.zeros(
+        (length + 2 * padding + int(hop * speed) * 2, samples.shape[1]),
+        dtype=samples.dtype,
+    )
+    padded[padding:padding + length] = samples
+    # First frame is centered on the input's start
+    positions = padding - hop + numpy.rint(
+        numpy.arange(count) * hop * speed,
+    ).astype(numpy.int64)
+    positions = _best_offsets(
+        padded[::WSOLA_DECIMATION].mean(axis=1, dtype=numpy.float32),
+        positions,
+        frame,
+        hop,
+        tolerance,
+    )
+    # Overlap-add, block by block to keep memory usage low
+    window = _hann(frame).astype(numpy.float32)[:, numpy.newaxis]
+    offsets = numpy.arange(frame)
+    result = numpy.zeros(
+        ((count + 1) * hop, samples.shape[1]),
+        dtype=numpy.float32,
+    )
+    for first in range(0, count, WSOLA_BLOCK_FRAMES):
+        block = positions[first:first + WSOLA_BLOCK_FRAMES]
+        frames = padded[block[:, numpy.newaxis] + offsets] * window
+        start = first * hop
+        end = start + len(block) * hop
+        result[start:end] += frames[:, :hop].reshape(-1, samples.shape[1])
+        result[start + hop:end + hop] += frames[:, hop:].reshape(
+            -1,
+            samples.shape[1],
+        )
+    return result[hop:hop + out_length]
+
+
+def gain_envelope(length, slice_frames, gain, ramp_frames=0, offset=0):
+    """Returns periodic gain envelope, `length` frames long
+
+    Every other slice (starting from the second one) is multiplied by `gain`,
+    the rest is left untouched. Optional linear ramps, `ramp_frames` long, are
+    applied at the beginning of every slice to avoid clicks.
+    `offset` is position of the first frame, used when processing in blocks.
+    """
+    period = numpy.ones(2 * slice_frames, dtype=numpy.float32)
+    period[slice_frames:] = gain
+    ramp_frames = min(ramp_frames, slice_frames)
+    if ramp_frames:
+        ramp = numpy.linspace(0, 1, ramp_frames, endpoint=False)
+        period[:ramp_frames] = gain + (1 - gain) * ramp
+        period[slice_frames:slice_frames + ramp_frames] = 1 + (gain - 1) * ramp
+    period = numpy.roll(period, -(offset % len(period)))
+    return numpy.resize(period, length)[:, numpy.newaxis]
+
+
+def copy_looped(target, source, offset, gain=1):
+    """Fills target with samples of source, starting at `offset`
+
+    Source is looped if needed; samples are copied in as few contiguous runs
+    as possible, and multiplied by `gain` on the way.
+    """
+    position = offset % len(source)
+    done = 0
+    while done < len(target):
+        count = min(len(target) - done, len(source) - position)
+        chunk = source[position:position + count]
+        if gain != 1:
+            info = numpy.iinfo(target.dtype)
+            chunk = numpy.clip(chunk * gain, info.min, info.max)
+        target[done:done + count] = chunk
+        done += count
+        position = 0
+
+
+@functools.lru_cache(maxsize=32)
+def _filter_bank(up, down):
+    """Returns polyphase low-pass filter bank for given rates ratio
+
+    Bank has one row for each tap, and `up` columns (one for each phase).
+    When downsampling, the filter must be proportionally longer, as its cutoff
+    is lower.
+    Designing the filter is costly for big ratios, so banks are cached.
+    """
+    taps_count = RESAMPLER_TAPS * max(1, -(-down // up))
+    length = taps_count * up
+    cutoff = RESAMPLER_ROLLOFF * 0.5 / max(up, down)
+    times = numpy.arange(length) - length // 2
+    taps = 2 * cutoff * numpy.sinc(2 * cutoff * times)
+    taps *= numpy.kaiser(length, RESAMPLER_KAISER_BETA)
+    # Compensate for zeros stuffed between samples while upsampling
+    taps *= up
+    return taps.reshape(taps_count, up).astype(numpy.float32)
+
+
+class Resampler(object):
+    """Polyphase resampler, changing frame rate by rational ratio
+
+    Can be fed with consecutive blocks of samples; it keeps as much history as
+    needed to make the output continuous.
+    Ratios needing more than RESAMPLER_MAX_PHASES phases (like 44100:12345)
+    are approximated, which changes the speed by a few parts per million.
+    """
+    def __init__(self, from_rate, to_rate, channels, exact=False):
+        ratio = Fraction(from_rate, to_rate)
+        if not exact:
+            ratio = ratio.limit_denominator(RESAMPLER_MAX_PHASES)
+        self.up = ratio.denominator
+        self.down = ratio.numerator
+        self.bank = _filter_bank(self.up, self.down)
+        taps = self.bank.shape[0]
+        # Filter is centered, so output is shifted to compensate its delay
+        self._delay = taps * self.up // 2
+        self._buffer = numpy.zeros((taps, channels), dtype=numpy.float32)
+        self._offset = -taps  # input position of the first buffered frame
+        self._next = 0  # number of the next output frame
+        self._consumed = 0  # number of input frames
+
+    def inverse(self, channels):
+        """Returns resampler changing frame rate back, by exactly inverse ratio
+
+        Approximated ratio is inverted, so the speed doesn't change at all.
+        """
+        return Resampler(self.up, self.down, channels, exact=True)
+
+    def length(self, frames):
+        """Returns number of output frames for given number of input ones"""
+        return -(-frames * self.up // self.down)
+
+    def process(self, samples, final=False):
+        """Resamples next block of samples
+
+        When `final` is set, the rest of the input is flushed, so that the
+        output is exactly as long as it should be.
+        """
+        taps = self.bank.shape[0]
+        self._consumed += len(samples)
+        parts = [self._buffer, samples.astype(numpy.float32, copy=False)]
+        if final:
+            parts.append(numpy.zeros_like(self._buffer))
+        self._buffer = numpy.concatenate(parts)
+        end = self._offset + len(self._buffer)
+        last = (end * self.up - 1 - self._delay) // self.down
+        if final:
+            last = min(last, self.length(self._consumed) - 1)
+        numbers = numpy.arange(self._next, last + 1)
+        result = numpy.empty(
+            (len(numbers), self._buffer.shape[1]),
+            dtype=numpy.float32,
+        )
+        # Working on contiguous channels and taps is way faster
+        channels = numpy.ascontiguousarray(self._buffer.T)
+        for start in range(0, len(numbers), RESAMPLER_BLOCK_FRAMES):
+            block = numbers[start:start + RESAMPLER_BLOCK_FRAMES]
+            times = block * self.down + self._delay
+            bases = times // self.up - self._offset
+            phases = times % self.up
+            output = numpy.zeros(
+                (len(channels), len(block)),
+                dtype=numpy.float32,
+            )
+            for k in range(taps):
+                coefficients = self.bank[k].take(phases)
+                indices = bases - k
+                for channel, samples in enumerate(channels):
+                    output[channel] += coefficients * samples.take(indices)
+            result[start:start + len(block)] = output.T
+        self._next = last + 1
+        # Drop frames that won't be needed anymore
+        needed = (self._next * self.down + self._delay) // self.up
+        drop = max(needed - taps + 1 - self._offset, 0)
+        self._buffer = self._buffer[drop:]
+        self._offset += drop
+        return result
+
+
+def resample(samples, from_rate, to_rate, out=None):
+    """Changes frame rate of the samples, returns float array
+
+    If `out` is passed (and it's long enough, see `resampled_length`),
+    samples are resampled block by block, and written into it instead.
+    """
+    if from_rate == to_rate:
+        if out is not None:
+            return store(samples, out)
+        return samples
+    resampler = Resampler(from_rate, to_rate, samples.shape[1])
+    if out is None:
+        return resampler.process(samples, final=True)
+    position = 0
+    for start in range(0, len(samples), RESAMPLER_BLOCK_FRAMES):
+        end = start + RESAMPLER_BLOCK_FRAMES
+        result = resampler.process(
+            samples[start:end],
+            final=end >= len(samples),
+        )
+        store(result, out[position:position + len(result)])
+        position += len(result)
+    return out[:position]
+
+
+def resampled_length(frames, from_rate, to_rate):
+    """Returns number of frames after resampling"""
+    if from_rate == to_rate:
+        return frames
+    return Resampler(from_rate, to_rate, 1).length(frames)
+
+
+def add_looped(accumulator, source, gain=1, offset=0):
+    """Adds samples of source (looped if needed) to the accumulator
+
+    `offset` is position in the source of the accumulator's first frame.
+    """
+    position = offset % len(source)
+    done = 0
+    while done < len(accumulator):
+        count = min(len(accumulator) - done, len(source) - position)
+        target = accumulator[done:done + count]
+        chunk = source[position:position + count]
+        if gain == 1:
+            target += chunk
+        else:
+            target += chunk * gain
+        done += count
+        position = 0
+
+
+def peak(samples):
+    """Returns peak (maximum absolute value) of the samples"""
+    if not samples.size:
+        return 0
+    return int(max(-int(samples.min()), int(samples.max())))
+
+
+def block_peaks(samples, block_frames=STORE_BLOCK_FRAMES):
+    """Returns array of peaks of consecutive blocks of samples"""
+    return numpy.array(
+        [
+            peak(samples[start:start + block_frames])
+            for start in range(0, len(samples), block_frames)
+        ],
+        dtype=numpy.int64,
+    )
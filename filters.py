@@ -1,147 +1,162 @@
-import os
-import os.path
+import functools
+import math
 import random
 
+from pydub.utils import db_to_float
+
 import audio
+import banks
 import config
+import dsp
+import stream
+import timing
 
 
-_PANZER_TRACKS = []
 _PANZER_PATH = 'panzerfaust'
-_OVERLAY_TRACKS = []
 _OVERLAY_PATH = 'overlay'
+PANZER_BANK = banks.SampleBank(_PANZER_PATH)
+OVERLAY_BANK = banks.SampleBank(_OVERLAY_PATH)
 
 
 def initialize_panzer_tracks():
-    """Initializes panzerfaust tracks, to keep them in memory for later use"""
-    if not os.path.exists(_PANZER_PATH):
-        return
-    for filename in os.listdir(_PANZER_PATH):
-        if not filename.endswith('.mp3'):
-            continue
-        path = os.path.join(_PANZER_PATH, filename)
-        track = audio.load(path)
-        _PANZER_TRACKS.append(track)
+    """Indexes panzerfaust tracks, they're loaded when needed"""
+    PANZER_BANK.index()
 
 
 def initialize_overlay_tracks():
-    """Initializes overlay tracks, to keep them in memory for later use"""
-    if not os.path.exists(_OVERLAY_PATH):
-        return
-    for filename in os.listdir(_OVERLAY_PATH):
-        if not filename.endswith('.mp3'):
-            continue
-        path = os.path.join(_OVERLAY_PATH, filename)
-        track = audio.load(path)
-        _OVERLAY_TRACKS.append(track)
+    """Indexes overlay tracks, they're loaded when needed"""
+    OVERLAY_BANK.index()
 
 
-def _prepare(track):
-    """Cut track to exact number of seconds we need
+def _prepare(track, length):
+    """Cut track to exact number of milliseconds we need
 
     This function is required, because all incoming tracks are twice as long,
     in order to be able to properly use speed up/tone down filters.
     """
-    return track[:audio.SEGMENT_LENGTH_SECONDS]
+    return audio.view(track, 0, length)
+
 
+def _random_rate(fil, rng=None):
+    """Returns random rate for filter changing track's duration"""
+    return round((rng or random).uniform(*RATE_RANGES[fil]), 2)
 
-def speed_up(track):
+
+# All filters take optional `rng` - random generator to use instead of the
+# global one, so that rendering in the background doesn't change what is
+# drawn in the interface.
+def speed_up(track, rate=None, rng=None):
     """Speeds up the track"""
-    rate = random.uniform(*config.SPEED_UP_RANGE)
-    return audio.pitch(track, round(rate, 2))
+    if rate is None:
+        rate = _random_rate('speed up', rng)
+    return audio.pitch(track, rate)
 
 
-def slow_down(track):
+def slow_down(track, rate=None, rng=None):
     """Slows down the track"""
-    rate = random.uniform(*config.SLOW_DOWN_RANGE)
-    return audio.pitch(track, round(rate, 2))
+    if rate is None:
+        rate = _random_rate('slow down', rng)
+    return audio.pitch(track, rate)
 
 
-def reverse(track):
+def reverse(track, rng=None):
     """Reverses the track"""
     return audio.reverse(track)
 
 
-def frequency(track):
+def frequency(track, rng=None):
     """Changes frequency, effectively worsening the quality"""
-    frequency = random.randint(*config.FREQUENCY_RANGE)
+    frequency = (rng or random).randint(*config.FREQUENCY_RANGE)
     return audio.frequency(track, frequency)
 
 
-def volume_changer(track):
+def volume_changer(track, rng=None):
     """Changes volume of the track"""
-    slice_length = random.choice(config.SLICE_LENGTH)
+    slice_length = (rng or random).choice(config.SLICE_LENGTH)
     return audio.volume_changer(track, slice_length)
 
 
-def tone_down(track):
+def tone_down(track, rate=None, rng=None):
     """Lowers tone of the track without lowering speed"""
-    rate = random.uniform(*config.TONE_DOWN_RANGE)
-    return audio.tone_down(track, round(rate, 2))
+    if rate is None:
+        rate = _random_rate('tone down', rng)
+    return audio.tone_down(track, rate)
 
 
-def panzerfaust(track):
+def panzerfaust(track, rng=None):
     """Mixes track with one of the panzer tracks"""
-    if not _PANZER_TRACKS:
+    if not PANZER_BANK:
         return track
-    panzer_track = random.choice(_PANZER_TRACKS)
-    # Cut panzer track to track's length
-    track_length = len(track)
-    # Fix: not all panzer tracks have proper length!
-    while len(panzer_track) < track_length:
-        panzer_track = panzer_track + panzer_track
-    panzer_track = panzer_track[:track_length]
-    # Lower volume of panzer track
-    panzer_track -= config.PANZER_VOLUME_DECREASE
-    slice_length = random.choice(config.SLICE_LENGTH)
-    return audio.mix_segments([track, panzer_track], slice_length)
-
-
-def multiple_tracks(tracks):
+    panzer_track = PANZER_BANK.choice(rng, stream.get_format(track))
+    slice_length = (rng or random).choice(config.SLICE_LENGTH)
+    # Fix: not all panzer tracks have proper length, so they're looped!
+    return audio.mix_segments(
+        [track, panzer_track],
+        slice_length,
+        loop=True,
+        gains=[0, -config.PANZER_VOLUME_DECREASE],
+    )
+
+
+def multiple_tracks(tracks, rng=None):
     """Mixes multiple tracks into single one
 
     Tracks will be mixed with either of these methods, chosen randomly:
     - mix_segments
     - overlay
     """
-    slice_length = random.choice(config.MULTIPLE_TRACKS_LENGTH)
-    return audio.mix_segments(tracks, slice_length)
+    slice_length = (rng or random).choice(config.MULTIPLE_TRACKS_LENGTH)
+    with timing.stage('mix', sum(len(track._data) for track in tracks)):
+        return audio.mix_segments(tracks, slice_length)
 
 
-def overlay_music(track):
+def overlay_music(track, rng=None):
     """Adds another song layer"""
-    if not _OVERLAY_TRACKS:
+    if not OVERLAY_BANK:
         return track
-    overlay_track = random.choice(_OVERLAY_TRACKS)
+    bank_track = OVERLAY_BANK.choice(rng, stream.get_format(track))
     # Cut overlay track to track's length
     track_length = len(track)
-    if len(overlay_track) > track_length:
-        overlay_track = audio.cut(
-            overlay_track,
+    start, end = 0, len(bank_track)
+    if len(bank_track) > track_length:
+        start, end = audio.random_window(
+            len(bank_track),
             track_length,
             0,
-            len(overlay_track) - track_length,
+            len(bank_track) - track_length,
+            rng,
         )
-    if track.max > overlay_track.max:
-        overlay_track += 3
-    # Lower volume of our track
-    track -= config.OVERLAY_VOLUME_DECREASE
-    return audio.overlay([track, overlay_track])
+    overlay_track = audio.view(bank_track, start, end)
+    # Make overlay track louder if it's quieter than ours (peaks of the bank
+    # track are known already), and lower volume of our track
+    overlay_gain = 0
+    if audio.peak(track) > audio.peak(bank_track, start, end):
+        overlay_gain = 3
+    return audio.overlay(
+        [track, overlay_track],
+        gains=[-config.OVERLAY_VOLUME_DECREASE, overlay_gain],
+    )
 
 
-# NOTE (2015.07.02): all filters that use pydub's speedup function are
-# currently turned off, due to my netbook being too slow to be able to use it
 FILTERS = {
     'speed up': speed_up,
     'slow down': slow_down,
     'reverse': reverse,
     'frequency': frequency,
     'volume changer': volume_changer,
-    # 'tone down': tone_down,
+    'tone down': tone_down,
     'panzerfaust': panzerfaust,
     'overlay': overlay_music,
 }
 FILTERS_LIST = list(FILTERS)
+# Filters changing track's frame rate, along with ranges of their rates
+RATE_RANGES = {
+    'speed up': config.SPEED_UP_RANGE,
+    'slow down': config.SLOW_DOWN_RANGE,
+    'tone down': config.TONE_DOWN_RANGE,
+}
+# ...of which these change track's duration, too
+CHANGE_DURATION = ('speed up', 'slow down')
 DONT_LIKE_EACH_OTHER = {
     'speed up': ('slow down',),
     'slow down': ('speed up',),
@@ -183,11 +198,226 @@ def get_random_filters():
     return filters
 
 
-def apply(track, filters):
+def get_additional_tracks(selected, candidates):
+    """Returns list of selected track and up to 2 randomly chosen others
+
+    `candidates` is a list of tracks that weren't played yet.
+    """
+    tracks = [selected]
+    if random.random() >= config.LOAD_MULTIPLE_THRESHOLD:
+        return tracks
+    if random.random() < config.LOAD_TRIPLE_THRESHOLD:
+        count = 2
+    else:
+        count = 1
+    for _ in range(count):
+        for __ in range(10):
+            chosen = random.choice(candidates)
+            if chosen not in tracks:
+                tracks.append(chosen)
+                break
+    return tracks
+
+
+def input_length(filters, rates, length):
+    """Calculates how long the track must be to get `length` ms of output
+
+    Filters changing duration of the track are taken into account (in reverse
+    order), all other filters keep it as it is.
+    """
+    for fil in reversed(filters):
+        if fil in CHANGE_DURATION:
+            length = int(math.ceil(length * rates[fil]))
+    return length
+
+
+def apply(track, filters, length=None, cancel=None, rng=None):
     """Applies given filters on the track
 
     Filters list must be passed as list of strings.
+    If `length` (in ms) is passed, only part of the track that is needed to
+    render that much output is processed, and the result is cut to `length`.
+    If `cancel` event is set in the meantime, None is returned as soon as
+    currently applied filter is finished.
+    Random parameters of filters are drawn from `rng`, if it's passed.
     """
+    rates = {
+        fil: _random_rate(fil, rng) for fil in filters if fil in RATE_RANGES
+    }
+    if length is not None:
+        track = _prepare(track, input_length(filters, rates, length))
     for fil in filters:
-        track = FILTERS[fil](track)
+        if cancel is not None and cancel.is_set():
+            return None
+        with timing.stage(fil, len(track._data)):
+            if fil in rates:
+                track = FILTERS[fil](track, rates[fil], rng=rng)
+            else:
+                track = FILTERS[fil](track, rng=rng)
+    if length is not None:
+        track = _prepare(track, length)
     return track
+
+
+def _frequency_processor(stream_format, track, length, rng):
+    frequency = rng.randint(*config.FREQUENCY_RANGE)
+    return stream.Frequency(stream_format, frequency)
+
+
+def _volume_changer_processor(stream_format, track, length, rng):
+    slice_length = rng.choice(config.SLICE_LENGTH)
+    gain = db_to_float(-audio.VOLUME_CHANGER_DECREASE)
+    return stream.VolumeChanger(stream_format, slice_length, gain)
+
+
+def _panzerfaust_processor(stream_format, track, length, rng):
+    if not PANZER_BANK:
+        return None
+    panzer_track = PANZER_BANK.choice(rng, stream_format)
+    slice_length = rng.choice(config.SLICE_LENGTH)
+    return stream.Interleave(
+        stream_format,
+        audio.to_array(panzer_track),
+        slice_length,
+        db_to_float(-config.PANZER_VOLUME_DECREASE),
+    )
+
+
+def _overlay_processor(stream_format, track, length, rng):
+    if not OVERLAY_BANK:
+        return None
+    bank_track = OVERLAY_BANK.choice(rng, stream_format)
+    start, end = 0, len(bank_track)
+    if len(bank_track) > length:
+        start, end = audio.random_window(
+            len(bank_track),
+            length,
+            0,
+            len(bank_track) - length,
+            rng,
+        )
+    # Layer is made louder if it's quieter than the blocks it's mixed into,
+    # which may be already changed by previous filters
+    return stream.Overlay(
+        audio.to_array(audio.view(bank_track, start, end)),
+        db_to_float(-config.OVERLAY_VOLUME_DECREASE),
+        audio.peak(bank_track, start, end),
+        db_to_float(3),
+    )
+
+
+def _reverse_samples(samples, stream_format, rate):
+    return samples[::-1]
+
+
+def _tone_down_samples(samples, stream_format, rate):
+    return dsp.time_stretch(samples, 1/rate, stream_format.frame_rate)
+
+
+# Filters that can process the track block by block...
+STREAM_PROCESSORS = {
+    'frequency': _frequency_processor,
+    'volume changer': _volume_changer_processor,
+    'panzerfaust': _panzerfaust_processor,
+    'overlay': _overlay_processor,
+}
+# ...and the ones that need whole track at once
+BUFFERED = {
+    'reverse': _reverse_samples,
+    'tone down': _tone_down_samples,
+}
+
+
+def apply_blocks(track, filters, length, rng=None):
+    """Applies given filters on the track, block by block
+
+    Works like `apply`, but instead of rendering whole track it returns its
+    format and generator of raw PCM blocks, so the track can be played while
+    it's being rendered. Only filters from `BUFFERED` need whole track to be
+    rendered at once.
+    """
+    rng = rng or random
+    rates = {
+        fil: _random_rate(fil, rng) for fil in filters if fil in RATE_RANGES
+    }
+    track = _prepare(track, input_length(filters, rates, length))
+    if track.sample_width not in dsp.DTYPES:
+        track = track.set_sample_width(4)
+    stream_format = stream.get_format(track)
+    block_frames = stream.ms_to_frames(stream_format, config.BLOCK_LENGTH)
+    blocks = stream.split(audio.to_array(track), block_frames)
+    for fil in filters:
+        if fil in BUFFERED:
+            function = functools.partial(
+                BUFFERED[fil],
+                stream_format=stream_format,
+                rate=rates.get(fil),
+            )
+            blocks = stream.buffered(
+                blocks,
+                stream_format,
+                function,
+                block_frames,
+                timing.Stage(fil),
+            )
+        elif fil in STREAM_PROCESSORS:
+            processor = STREAM_PROCESSORS[fil](
+                stream_format,
+                track,
+                length,
+                rng,
+            )
+            if processor is not None:
+                blocks = stream.process(blocks, processor, timing.Stage(fil))
+        if fil in rates:
+            # Pitching changes only the frame rate, data stays the same
+            stream_format = stream_format._replace(
+                frame_rate=int(stream_format.frame_rate*rates[fil]),
+            )
+    blocks = stream.limit(blocks, stream.ms_to_frames(stream_format, length))
+    return stream_format, stream.encode(blocks, stream_format)
+
+
+def _live_split(filters):
+    """Returns index where the chain is split into offline and live filters
+
+    Player applies live filters after the rendered ones, so only filters
+    that aren't followed by any offline filter can be live - order of the
+    chain is kept.
+    """
+    split = len(filters)
+    while split and filters[split - 1] in STREAM_PROCESSORS:
+        split -= 1
+    return split
+
+
+def live_filters(filters):
+    """Returns filters that can be applied while the track is playing"""
+    return list(filters[_live_split(filters):])
+
+
+def offline_filters(filters):
+    """Returns filters that need to be applied before playing"""
+    return list(filters[:_live_split(filters)])
+
+
+def live_effects(track, filters, length, stream_format=None, rng=None):
+    """Returns chain of processors applied by the player, while playing
+
+    Only filters from `STREAM_PROCESSORS` are applied, the rest should be
+    applied beforehand. Any of them can be switched on and off later on, in
+    the middle of the track.
+    Returns None if the track's format can't be processed.
+    """
+    if stream_format is None:
+        stream_format = stream.get_format(track)
+    if stream_format.sample_width not in dsp.DTYPES:
+        return None
+    rng = rng or random
+
+    def factory(fil):
+        return STREAM_PROCESSORS[fil](stream_format, track, length, rng)
+
+    effects = stream.Effects(stream_format, factory)
+    effects.update(live_filters(filters))
+    return effects
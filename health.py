@@ -0,0 +1,115 @@
+"""Health of the playback
+
+Player counts underruns, measures how long it takes to prepare every period
+of audio, how full the queue of rendered blocks is and how long it takes
+from starting the playback to the first sample leaving the device. Stats of
+every played track are saved to a metrics file of the session, so that it's
+possible to tune the period size and spot overloaded hardware.
+"""
+from datetime import datetime
+import json
+import time
+
+import config
+
+
+SESSION = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+
+class Stats(object):
+    """Stats of single playback
+
+    Updated only by the audio thread, without locking - other threads may
+    read slightly outdated values, but never block the device.
+    """
+    def __init__(self, period_size, frame_rate, device_latency=0,
+                 started=None):
+        # `time.perf_counter()` of pressing play, now by default
+        self.started = started or time.perf_counter()
+        self.period_size = period_size
+        self.frame_rate = frame_rate
+        self.device_latency = device_latency  # in seconds
+        self.first_sample = None  # in seconds, from play() until it's heard
+        self.periods = 0
+        self.underruns = 0  # reported by the device
+        self.starved = 0  # periods not rendered in time after the first one
+        self.callback_total = 0.0
+        self.callback_max = 0.0
+        self.fill_total = 0.0
+        self.fill_min = None
+        self.fill_count = 0
+        self.info = {}
+        self.saved = False
+
+    @property
+    def period(self):
+        """Duration of single period, in seconds"""
+        return self.period_size / self.frame_rate
+
+    def update(self, seconds, underrun, starved, fill=None):
+        """Records single period
+
+        `seconds` is time spent preparing it, `fill` is fill level (0-1) of
+        the buffer it was read from, if there's one.
+        """
+        self.periods += 1
+        self.underruns += underrun
+        self.starved += starved
+        self.callback_total += seconds
+        if seconds > self.callback_max:
+            self.callback_max = seconds
+        if fill is not None:
+            self.fill_total += fill
+            self.fill_count += 1
+            if self.fill_min is None or fill < self.fill_min:
+                self.fill_min = fill
+
+    def first(self, ahead):
+        """Records first sample, which will be heard in `ahead` seconds"""
+        self.first_sample = time.perf_counter() - self.started + ahead
+
+    def summary(self):
+        """Returns compact summary, to be displayed while playing"""
+        parts = ['xruns {count}'.format(count=self.underruns + self.starved)]
+        parts.append('cb {max:.1f}/{period:.1f}ms'.format(
+            max=self.callback_max * 1000,
+            period=self.period * 1000,
+        ))
+        if self.fill_min is not None:
+            parts.append('buf {fill:.0%}'.format(fill=self.fill_min))
+        if self.first_sample is not None:
+            parts.append('start {ms:.0f}ms'.format(
+                ms=self.first_sample * 1000,
+            ))
+        return ' '.join(parts)
+
+    def as_dict(self):
+        result = {
+            'time': time.time(),
+            'period_size': self.period_size,
+            'frame_rate': self.frame_rate,
+            'device_latency': self.device_latency,
+            'first_sample': self.first_sample,
+            'periods': self.periods,
+            'underruns': self.underruns,
+            'starved': self.starved,
+            'callback_mean': self.callback_total / max(self.periods, 1),
+            'callback_max': self.callback_max,
+            'fill_mean': (
+                self.fill_total / self.fill_count if self.fill_count else None
+            ),
+            'fill_min': self.fill_min,
+        }
+        result.update(self.info)
+        return result
+
+
+def save(stats):
+    """Appends stats to the metrics file of the session, only once"""
+    if not config.HEALTH_ENABLED or stats is None or stats.saved:
+        return
+    if not stats.periods:
+        return
+    stats.saved = True
+    with open(config.HEALTH_LOG.format(session=SESSION), 'a') as f:
+        f.write(json.dumps(stats.as_dict()) + '\n')
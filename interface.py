@@ -6,19 +6,37 @@ Battle-tested on Solarized color scheme and under tmux.
 """
 from contextlib import contextmanager
 from datetime import datetime
+import importlib
 import os
 import os.path
+import queue
 import random
 import sys
+import threading
+import time
+
+STARTED = time.time()  # taken before importing anything that takes a while
 
 import npyscreen
 
 from pyaudio_fix import fix_pyaudio
-import audio
 import config
-import filters
+import timing
 import utils
 
+# These take a while to import, and aren't needed by the settings screen
+HEAVY_MODULES = (
+    'audio', 'filters', 'library', 'prefetch', 'prerender', 'render',
+    'worker',
+)
+audio = utils.lazy_import('audio')
+filters = utils.lazy_import('filters')
+library = utils.lazy_import('library')
+prefetch = utils.lazy_import('prefetch')
+prerender = utils.lazy_import('prerender')
+render = utils.lazy_import('render')
+worker = utils.lazy_import('worker')
+
 
 @contextmanager
 def use_xterm():
@@ -33,13 +51,15 @@ def use_xterm():
         os.environ['TERM'] = old_value
 
 
-def quit():
+def quit(app=None):
     """Close application gracefully"""
-    audio.stop()
+    audio.close()
+    if app is not None:
+        app.shutdown()
     sys.exit(0)
 
 
-def show_quit_popup(key=None):
+def show_quit_popup(app):
     """Display popup asking whether to quit application"""
     result = npyscreen.notify_yes_no(
         message='Do you really want to quit?',
@@ -47,7 +67,7 @@ def show_quit_popup(key=None):
         editw=1,  # select No button by default
     )
     if result:
-        quit()
+        quit(app)
 
 
 class TracksListWidget(npyscreen.TitleSelectOne):
@@ -60,42 +80,46 @@ class TracksListWidget(npyscreen.TitleSelectOne):
 
         Returns list of filenames.
         """
-        app = self.parent.parentApp
-        filenames = [filename]
-        if random.random() >= config.LOAD_MULTIPLE_THRESHOLD:
-            return filenames
-        app.notify('Multiple tracks selected!')
-        if random.random() < config.LOAD_TRIPLE_THRESHOLD:
-            count = 2
-        else:
-            count = 1
-        for _ in range(count):
-            for __ in range(10):
-                selected = random.choice(self.values)
-                if selected not in filenames:
-                    filenames.append(selected)
-                    break
+        filenames = filters.get_additional_tracks(filename, self.values)
+        if len(filenames) > 1:
+            self.parent.parentApp.notify('Multiple tracks selected!')
         return filenames
 
     def load_tracks(self, filenames):
-        """Loads files as pydub tracks"""
+        """Loads files as pydub tracks
+
+        Most of the time these are already loaded in the background, the
+        rest is loaded concurrently.
+        """
         app = self.parent.parentApp
-        tracks = []
-        for filename in filenames:
-            app.notify('Loading {title}...'.format(title=filename))
-            track = audio.load(filename)
-            if not app._already_cut:
-                track = audio.cut(track, app._track_length * 2)
-            tracks.append(track)
-        return tracks
+        loaded = []
+
+        def progress(filename):
+            loaded.append(filename)
+            app.notify('Loaded {title} ({i}/{total})'.format(
+                title=filename,
+                i=len(loaded),
+                total=len(filenames),
+            ))
+
+        app.notify('Loading {count} track(s)...'.format(count=len(filenames)))
+        return app.prefetcher.get_many(filenames, progress)
+
+    def prefetch_upcoming(self, track_no):
+        """Starts loading tracks that will probably be selected next"""
+        app = self.parent.parentApp
+        upcoming = sorted(no for no in self.values if no > track_no)
+        app.prefetcher.schedule(
+            app.filenames[no] for no in upcoming[:config.PREFETCH_COUNT]
+        )
 
     def get_infos(self, filenames):
         """Obtains infos about filenames"""
         app = self.parent.parentApp
         infos = []
         for filename in filenames:
-            info = audio.get_info(filename)
-            no = app._filenames_list.index(filename) + 1
+            info = app.library.get_info(filename)
+            no = app.track_numbers[filename]
             infos.append('No. {no}'.format(no=no),)
             infos += info
             infos.append('\n')
@@ -109,20 +133,32 @@ class TracksListWidget(npyscreen.TitleSelectOne):
         if not self.value:
             return
         app = self.parent.parentApp
+        if not app.loaded.is_set():
+            # Tracks (or filters) are still being loaded in the background
+            app.notify('Still loading, please wait...')
+            self.value = []
+            self.display()
+            return
         filename = self.values[self.value[0]]
+        self.prefetch_upcoming(filename)
+        if app.rounds is not None:
+            self.load_round(filename)
+            return
         filenames = self.get_additional_filenames(filename)
         song_info = self.parent.get_widget('song-info')
         # Load everything
         filenames = [app.filenames.get(v) for v in filenames]
         infos = self.get_infos(filenames)
-        tracks = self.load_tracks(filenames)
+        with timing.context(*filenames):
+            tracks = self.load_tracks(filenames)
         self.parent.set_status('Loading')
         song_info.values = infos
         song_info.display()
         # Mix 'em up!
-        track = filters.multiple_tracks(tracks)
-        app.current_track = track
         app.current_track_nos = filenames
+        with timing.context(*filenames):
+            track = app.mix_tracks(tracks)
+        app.current_track = track
         app.notify('Loaded!')
         # Also, clear filters
         self.parent.h_reset_filters()
@@ -131,13 +167,71 @@ class TracksListWidget(npyscreen.TitleSelectOne):
         self.value = []
         self.display()
 
+    def load_round(self, round_no):
+        """Loads already rendered round, see `prerender` module"""
+        app = self.parent.parentApp
+        entry = app.rounds[round_no]
+        filename = app.filenames[round_no]
+        infos = []
+        for no, info in zip(entry['numbers'], entry['infos']):
+            infos.append('No. {no}'.format(no=no))
+            infos += info
+            infos.append('\n')
+        song_info = self.parent.get_widget('song-info')
+        song_info.values = infos
+        song_info.display()
+        with timing.context(filename):
+            app.current_track = self.load_tracks([filename])[0]
+        app.current_track_nos = [filename]
+        app.current_round = entry
+        app.filters = list(entry['filters'])
+        widget = self.parent.get_widget('filters')
+        widget.value = [filters.FILTERS_LIST.index(f) for f in app.filters]
+        widget.display()
+        app.notify('Loaded round {no}!'.format(no=round_no))
+        self.parent.set_status('Ready to play')
+        self.parent.calculate_points()
+        self.value = []
+        self.display()
+
 
 class MainForm(npyscreen.FormBaseNew):
     """Main form of the application"""
+    def while_waiting(self):
+        """Draws updates, called periodically when no key is pressed
+
+        Player only publishes its position and health stats, they're read
+        (and drawn) here, in the interface thread.
+        """
+        self.parentApp.process_updates()
+        error = audio.take_error()
+        if error is not None:
+            self.parentApp.notify('Playback failed: {error}'.format(
+                error=error,
+            ))
+            self.set_status('Ready to play')
+        position = audio.position()
+        if position is not None:
+            self.update_slider(position)
+        stats = audio.stats()
+        if stats is not None:
+            self.update_health(stats.summary())
+
     def update_slider(self, value):
         """Sets value of position slider"""
-        self.get_widget('position').value = value / 1000
-        self.get_widget('position').display()
+        slider = self.get_widget('position')
+        if slider.value == value / 1000:
+            return
+        slider.value = value / 1000
+        slider.display()
+
+    def update_health(self, summary):
+        """Sets summary of playback health"""
+        widget = self.get_widget('health')
+        if widget.value == summary:
+            return
+        widget.value = summary
+        widget.display()
 
     def h_play(self, key):
         """Plays currently selected track
@@ -145,33 +239,93 @@ class MainForm(npyscreen.FormBaseNew):
         Also applies filters, if any are selected.
         """
         app = self.parentApp
+        started = time.perf_counter()  # time to first sample counts from here
         if not app.current_track:
             app.notify('No track selected')
             return
         for filename in app.current_track_nos:
-            track_no = app._filenames_list.index(filename) + 1
+            track_no = app.track_numbers[filename]
             try:
                 self.get_widget('track-list').values.remove(track_no)
             except ValueError:
                 pass
         self.get_widget('track-list').value = []
         app.notify('Applying filters...')
-        track = filters.apply(app.current_track, self.parentApp.filters)
-        track = track[:app._track_length]
-        self.get_widget('position').entry_widget.out_of = len(track) / 1000
+        # Stages of the previous round (e.g. streamed filters) are done now
+        app.flush_timing()
+        with timing.context(*app.current_track_nos):
+            length = self.start_playback(started)
+        # Saved along with health stats, once the track is done
+        stats = audio.stats()
+        if stats is not None:
+            stats.info.update(
+                tracks=list(app.current_track_nos),
+                filters=list(app.filters),
+            )
+        self.get_widget('position').entry_widget.out_of = length / 1000
         self.get_widget('position').display()
-        audio.play(track, notifier=self.update_slider)
-        app.notify('Playing!')
+        app.notify('Playing! [{summary}]'.format(
+            summary=timing.summary(app.current_track_nos),
+        ))
+        app.played = {
+            'tracks': list(app.current_track_nos),
+            'filters': list(app.filters),
+        }
         self.set_status('Playing')
 
+    def start_playback(self, started=None):
+        """Renders current track (or starts streaming it) and plays it
+
+        `started` is passed to the player, see `audio.play`. Returns length of
+        the track, in ms.
+        """
+        app = self.parentApp
+        if app.rounds is not None:
+            track = app.current_track  # filters are already applied
+        else:
+            track = app.renderer.ready(
+                app.current_track,
+                app.rendered_filters(),
+                app._track_length,
+                app.round_seed('render'),
+            )
+        if track is None and config.STREAMING:
+            # Not rendered yet, so let's render it while playing
+            app.renderer.cancel()
+            stream_format, blocks = filters.apply_blocks(
+                app.current_track,
+                app.rendered_filters(),
+                app._track_length,
+                random.Random(app.round_seed('render')),
+            )
+            length = app._track_length
+            app.create_effects(app.current_track, stream_format)
+            audio.play_blocks(blocks, stream_format, app.effects, started)
+        else:
+            if track is None:
+                with timing.stage('render'):
+                    track = app.renderer.result(
+                        app.current_track,
+                        app.rendered_filters(),
+                        app._track_length,
+                        app.round_seed('render'),
+                    )
+            length = len(track)
+            app.create_effects(track)
+            audio.play(track, app.effects, started)
+        return length
+
     def h_stop(self, key):
         """Stops currently played track"""
         audio.stop()
+        self.parentApp.effects = None
         self.parentApp.notify('Stopped.')
         self.set_status('Ready to play')
 
     def h_select_filters(self, key):
         """Randomly selects filters"""
+        if self.filters_locked():
+            return
         selected = filters.get_random_filters()
         self.parentApp.filters = selected
         values = [filters.FILTERS_LIST.index(f) for f in selected]
@@ -180,17 +334,25 @@ class MainForm(npyscreen.FormBaseNew):
         widget.display()
         self.parentApp.notify('Filters randomized.')
         self.calculate_points()
+        self.update_effects()
+        self.schedule_render()
 
     def h_reset_filters(self, key=None):
         """Clears filters selection"""
+        if self.filters_locked():
+            return
         widget = self.get_widget('filters')
         widget.value = []
         self.parentApp.filters = []
         widget.display()
         self.parentApp.notify('Filters cleared.')
+        self.update_effects()
+        self.schedule_render()
 
     def h_toggle_filter(self, key):
         """Toggles single filter on the filters list"""
+        if self.filters_locked():
+            return
         index = int(chr(key)) - 1
         widget = self.get_widget('filters')
         try:
@@ -200,6 +362,46 @@ class MainForm(npyscreen.FormBaseNew):
             self.parentApp.filters.append(filters.FILTERS_LIST[index])
             widget.value.append(index)
         widget.display()
+        self.update_effects()
+        self.schedule_render()
+
+    def filters_locked(self):
+        """Checks whether filters can't be changed, as rounds are rendered"""
+        if self.parentApp.rounds is None:
+            return False
+        self.parentApp.notify('Filters are already rendered.')
+        return True
+
+    def update_effects(self):
+        """Switches filters of currently played track, without rendering
+
+        Samples of the filters may need to be loaded, so it's done in the
+        background, not to block the interface. Filters chosen for the next
+        track (while the previous one is still playing) are left for it.
+        """
+        app = self.parentApp
+        if app.effects is not None and app.current_track is app.playing_track:
+            app.effects.update(
+                filters.live_filters(app.filters),
+                background=True,
+            )
+
+    def schedule_render(self):
+        """Starts rendering current track with selected filters
+
+        Thanks to that, the track will (most probably) be ready right after
+        pressing play.
+        """
+        app = self.parentApp
+        if not app.current_track:
+            return
+        with timing.context(*app.current_track_nos):
+            app.renderer.schedule(
+                app.current_track,
+                app.rendered_filters(),
+                app._track_length,
+                app.round_seed('render'),
+            )
 
     def set_status(self, message):
         """Sets value for the status widget
@@ -214,13 +416,16 @@ class MainForm(npyscreen.FormBaseNew):
 
     def calculate_points(self):
         """Sets proper amount of points in Points widget"""
+        app = self.parentApp
         widget = self.get_widget('points')
         # Filters
-        points = config.FILTER_POINTS[len(self.parentApp.filters)]
+        points = config.FILTER_POINTS[len(app.filters)]
         # Multiple songs
-        points *= config.TRACKS_MULTIPLIER[
-            len(self.parentApp.current_track_nos)
-        ]
+        if app.current_round is not None:
+            tracks = app.current_round['tracks']
+        else:
+            tracks = app.current_track_nos
+        points *= config.TRACKS_MULTIPLIER[len(tracks)]
         widget.value = int(round(points))
         widget.display()
 
@@ -232,7 +437,7 @@ class MainForm(npyscreen.FormBaseNew):
         """
         super(MainForm, self).set_up_handlers()
         keys = {
-            '^q': show_quit_popup,
+            '^q': lambda key: show_quit_popup(self.parentApp),
             'a': self.h_play,
             's': self.h_stop,
             'f': self.h_select_filters,
@@ -254,6 +459,25 @@ class SettingsForm(npyscreen.Form):
     other things here.
     Should be displayed before main form.
     """
+    def beforeEditing(self):
+        """Measures how long it took to show the first screen"""
+        app = self.parentApp
+        if app.startup_time is not None:
+            return
+        app.startup_time = time.time() - STARTED
+        timing.record('startup', app.startup_time, started=STARTED)
+        timing.flush(startup=True)
+        status = self.get_widget('status')
+        status.value = 'Started in {time:.2f}s{warning}'.format(
+            time=app.startup_time,
+            warning=(
+                ' (target: {target:.2f}s)'.format(
+                    target=config.STARTUP_TARGET,
+                )
+                if app.startup_time > config.STARTUP_TARGET else ''
+            ),
+        )
+
     def afterEditing(self):
         """Sets proper values in the parent app after pressing OK button"""
         app = self.parentApp
@@ -272,9 +496,16 @@ class SettingsForm(npyscreen.Form):
         app._track_length = int(track_length) * 1000
         app._seed = seed
         app._already_cut = already_cut
-        app.load_filenames(path)
-        app.initialize_filters()
+        app.prefetcher = prefetch.Prefetcher(app.load_track)
+        if config.RENDER_WORKER:
+            app.worker = worker.Worker()
+        app.renderer = render.Renderer(app.render_track)
+        app.create_main_form()
         app.setNextForm('MAIN')
+        # Main form is usable right away, tracks appear when they're scanned
+        thread = threading.Thread(target=app.initialize, args=(path,))
+        thread.daemon = True
+        thread.start()
 
 
 class App(npyscreen.NPSAppManaged):
@@ -282,7 +513,8 @@ class App(npyscreen.NPSAppManaged):
     def __init__(self, *args, **kwargs):
         super(App, self).__init__(*args, **kwargs)
         self._filenames = {}
-        self._filenames_list = []
+        self.track_numbers = {}
+        self.library = None
         self._path = None
         self.current_track = None
         self.current_track_nos = []
@@ -290,6 +522,17 @@ class App(npyscreen.NPSAppManaged):
         self._seed = None
         self._already_cut = False
         self.filters = []
+        self.prefetcher = None
+        self.renderer = None
+        self.worker = None
+        self.startup_time = None
+        self.rounds = None
+        self.current_round = None
+        self.effects = None
+        self.playing_track = None  # current track when effects were created
+        self.played = None
+        self.loaded = threading.Event()  # set once tracks can be selected
+        self._updates = queue.Queue()
 
     @property
     def filenames(self):
@@ -298,19 +541,30 @@ class App(npyscreen.NPSAppManaged):
     @filenames.setter
     def filenames(self, value):
         self._filenames = value
-        self._filenames_list = [v for k, v in sorted(value.items())]
+        self.track_numbers = {v: k for k, v in value.items()}
         track_number = self.getForm('MAIN').get_widget('track-list')
         track_number.values = list(self._filenames.keys())
-        track_number.display()
+        self.in_ui(track_number.display)
 
     def onStart(self):
-        """Initializes all forms and populates it with widgets
+        """Initializes settings form, the rest is initialized later
 
-        TODO: maybe put each form code into:
-        1) separate method in App?
-        2) init method in each form?
-        Either of these would increase readability.
+        Heavy modules are imported in the background, while settings are
+        being filled in.
         """
+        self.create_settings_form()
+        thread = threading.Thread(target=self.import_modules)
+        thread.daemon = True
+        thread.start()
+        self.setNextForm('directory')
+
+    def import_modules(self):
+        """Imports modules that are needed after leaving settings form"""
+        for name in HEAVY_MODULES:
+            importlib.import_module(name)
+
+    def create_settings_form(self):
+        """Initializes settings form and populates it with widgets"""
         # Directory form
         directory_form = self.addForm(
             'directory',
@@ -347,8 +601,12 @@ class App(npyscreen.NPSAppManaged):
             value='this is some random seed',
             w_id='seed',
         )
+
+    def create_main_form(self):
+        """Initializes main form and populates it with widgets"""
         # Main form
         form = self.addForm('MAIN', MainForm, name='EKOiE')
+        form.keypress_timeout = config.UI_REFRESH
         form.add_widget(
             TracksListWidget,
             name='Track number',
@@ -384,7 +642,14 @@ class App(npyscreen.NPSAppManaged):
             name='Song status',
             w_id='song-status',
         )
-        form.nextrely += 2
+        form.add_widget(
+            npyscreen.TitleFixedText,
+            height=1,
+            editable=False,
+            name='Playback',
+            w_id='health',
+        )
+        form.nextrely += 1
         # Slider
         form.add_widget(
             npyscreen.TitleSlider,
@@ -412,7 +677,6 @@ class App(npyscreen.NPSAppManaged):
             name='Points',
             w_id='points',
         )
-        self.setNextForm('directory')
 
     def notify(self, message):
         """Displays notification in the bottom of the screen"""
@@ -421,26 +685,182 @@ class App(npyscreen.NPSAppManaged):
             time=datetime.now().strftime('%H:%M:%S'),
             message=message,
         )
-        status.display()
+        self.in_ui(status.display)
+
+    def in_ui(self, function, *args):
+        """Calls function in the interface thread
+
+        Curses isn't thread-safe, so when called from another thread, the
+        function is queued and called by `MainForm.while_waiting`.
+        """
+        if threading.current_thread() is threading.main_thread():
+            function(*args)
+        else:
+            self._updates.put((function, args))
+
+    def process_updates(self):
+        """Calls functions queued by other threads"""
+        while True:
+            try:
+                function, args = self._updates.get_nowait()
+            except queue.Empty:
+                return
+            function(*args)
 
     def load_filenames(self, path):
         """Loads filenames of tracks from working directory"""
         self.notify(
             'Loading files from {path}...'.format(path=path),
         )
+        self.library = library.Library(path)
+        self.library.scan()
         self.filenames = utils.shuffle(
-            utils.get_filenames(path),
+            self.library.get_filenames(),
             seed=self._seed,
         )
         self.notify('{count} files loaded.'.format(count=len(self.filenames)))
+        first = sorted(self.filenames)[:config.PREFETCH_COUNT]
+        self.prefetcher.schedule(self.filenames[no] for no in first)
+
+    def load_rounds(self, path, manifest):
+        """Loads list of rounds rendered in advance"""
+        self.rounds = {entry['round']: entry for entry in manifest['rounds']}
+        self.filenames = {
+            no: os.path.join(path, entry['file'])
+            for no, entry in self.rounds.items()
+        }
+        self.notify('{count} rendered rounds loaded.'.format(
+            count=len(self.rounds),
+        ))
+        first = sorted(self.filenames)[:config.PREFETCH_COUNT]
+        self.prefetcher.schedule(self.filenames[no] for no in first)
+
+    def seed(self, *keys):
+        """Returns seed for random generator of a background job
+
+        It's derived from the seed from settings and given keys (e.g. track's
+        filename), instead of being drawn from the global generator, so it's
+        the same no matter when (and in which thread) the job is run.
+        """
+        return ':'.join(str(key) for key in (self._seed,) + keys)
+
+    def round_seed(self, purpose):
+        """Returns seed for random generator used for the current round"""
+        return self.seed(purpose, *self.current_track_nos)
+
+    def flush_timing(self):
+        """Saves timing of stages of the last played round"""
+        if self.played is not None:
+            timing.flush(self.played['tracks'], **self.played)
+            self.played = None
+
+    def shutdown(self):
+        """Stops background work, saving timing of the last round"""
+        self.flush_timing()
+        if self.renderer is not None:
+            self.renderer.shutdown()
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+        if self.worker is not None:
+            self.worker.shutdown()
+
+    def load_track(self, filename):
+        """Loads single track, cutting it to proper length if needed"""
+        with timing.context(filename):
+            return self._load_track(filename)
+
+    def _load_track(self, filename):
+        if self.rounds is not None:
+            return audio.load_wav(filename)
+        length = None if self._already_cut else self._track_length * 2
+        seed = self.seed('load', filename)
+        if self.worker is not None:
+            return self.worker.load(filename, length, seed).result()
+        if length is None:
+            return audio.load(filename)
+        return audio.load_cut(filename, length, rng=random.Random(seed))
+
+    def mix_tracks(self, tracks):
+        """Mixes tracks of the round, see `filters.multiple_tracks`"""
+        seed = self.round_seed('mix')
+        if self.worker is not None:
+            return self.worker.mix(tracks, seed).result()
+        return filters.multiple_tracks(tracks, random.Random(seed))
+
+    def render_track(self, track, filters_list, length, cancel=None,
+                     seed=None):
+        """Applies filters on the track, see `filters.apply`"""
+        if self.worker is None:
+            return filters.apply(
+                track,
+                filters_list,
+                length,
+                cancel,
+                random.Random(seed),
+            )
+        future = self.worker.apply(track, filters_list, length, seed)
+        return self.worker.wait(future, cancel)
+
+    def rendered_filters(self):
+        """Returns filters that have to be applied before playing
+
+        In real-time mode, the rest is applied by the player.
+        """
+        if config.REALTIME_FILTERS:
+            return filters.offline_filters(self.filters)
+        return list(self.filters)
+
+    def create_effects(self, track, stream_format=None):
+        """Prepares filters applied by the player, in real-time mode"""
+        self.effects = None
+        self.playing_track = self.current_track
+        if config.REALTIME_FILTERS and self.rounds is None:
+            self.effects = filters.live_effects(
+                track,
+                self.filters,
+                self._track_length,
+                stream_format,
+                random.Random(self.round_seed('live')),
+            )
+
+    def initialize(self, path):
+        """Scans tracks and loads filters, run in the background
+
+        If the directory contains rounds rendered in advance, these are
+        loaded instead, and filters aren't needed at all.
+        """
+        manifest = utils.load_manifest(path, prerender.MANIFEST_FILENAME)
+        if manifest is not None:
+            self.load_rounds(path, manifest)
+            self.loaded.set()
+            return
+        self.load_filenames(path)
+        self.initialize_filters()
 
     def initialize_filters(self):
-        self.notify('Initializing panzerfaust filter...')
+        """Indexes tracks of filters, then warms the cache with them
+
+        Tracks can be selected as soon as they're indexed, they're loaded
+        lazily when needed.
+        """
+        self.notify('Initializing filters...')
         filters.initialize_panzer_tracks()
-        self.notify('Initializing overlay filter...')
         filters.initialize_overlay_tracks()
+        self.loaded.set()
+        self.warm_bank('panzerfaust', filters.PANZER_BANK)
+        self.warm_bank('overlay', filters.OVERLAY_BANK)
         self.notify('Filters initialized.')
 
+    def warm_bank(self, name, bank):
+        """Decodes tracks of the bank to the cache, displaying the progress"""
+        def progress(i, total):
+            self.notify('Caching {name} tracks {i}/{total}...'.format(
+                name=name,
+                i=i,
+                total=total,
+            ))
+        bank.warm(progress)
+
 
 if __name__ == '__main__':
     with use_xterm():
@@ -449,4 +869,4 @@ if __name__ == '__main__':
         try:
             app.run()
         except KeyboardInterrupt:
-            quit()
+            quit(app)
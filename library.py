@@ -0,0 +1,216 @@
+"""Persistent index of tracks library
+
+Paths, modification times, tags and durations of all tracks are kept in SQLite
+database inside tracks directory (or in the cache directory, if tracks
+directory is read-only). On each start only directories that were modified
+since last scan are listed again, and only new or modified tracks have their
+tags read. Broken tracks are skipped.
+"""
+import hashlib
+import os
+import os.path
+import sqlite3
+import threading
+
+from mutagen import MutagenError
+from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3NoHeaderError
+from mutagen.mp3 import MP3
+
+import config
+
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS directories ('
+    '  path TEXT PRIMARY KEY,'
+    '  parent TEXT,'
+    '  mtime REAL'
+    ')',
+    'CREATE TABLE IF NOT EXISTS tracks ('
+    '  path TEXT PRIMARY KEY,'
+    '  directory TEXT,'
+    '  mtime REAL,'
+    '  size INTEGER,'
+    '  title TEXT,'
+    '  artist TEXT,'
+    '  duration REAL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent)',
+    'CREATE INDEX IF NOT EXISTS tracks_directory ON tracks (directory)',
+)
+
+
+def read_tags(filename):
+    """Returns (title, artist, duration) of the track"""
+    try:
+        info = EasyID3(filename)
+        title = ', '.join(info.get('title', []))
+        artist = ', '.join(info.get('artist', []))
+    except ID3NoHeaderError:
+        title = artist = ''
+    return title, artist, MP3(filename).info.length
+
+
+def _connect(directory):
+    """Opens writable index of given directory
+
+    It's kept inside the directory, but if it can't be written there, it's
+    kept in the cache directory instead - or in memory, as the last resort.
+    """
+    key = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+    candidates = [
+        os.path.join(directory, config.LIBRARY_FILENAME),
+        os.path.join(config.CACHE_PATH, 'library-{key}.sqlite'.format(
+            key=key,
+        )),
+    ]
+    for path in candidates:
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False)
+            # Journal isn't created and deleted with every transaction, so
+            # the directory isn't modified by writing to the index
+            db.execute('PRAGMA journal_mode=TRUNCATE')
+            with db:
+                db.execute('BEGIN IMMEDIATE')  # fails if it's read-only
+                for statement in SCHEMA:
+                    db.execute(statement)
+            return db
+        except (OSError, sqlite3.Error):
+            continue
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    with db:
+        for statement in SCHEMA:
+            db.execute(statement)
+    return db
+
+
+class Library(object):
+    """Index of all tracks in given directory
+
+    Paths are stored relative to the directory, so it can be moved around.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._db = _connect(directory)
+        self._lock = threading.Lock()
+        self._tracks = {}
+
+    def scan(self):
+        """Updates the index, skipping directories that weren't modified"""
+        with self._lock:
+            with self._db:
+                self._scan_directory('.', None)
+            # Index may be kept in the directory itself, so its modification
+            # time is taken again, after the index is written
+            with self._db:
+                self._db.execute(
+                    'UPDATE directories SET mtime = ? WHERE path = ?',
+                    (os.stat(self.directory).st_mtime, '.'),
+                )
+            self._tracks = {
+                os.path.normpath(os.path.join(self.directory, path)): (
+                    title,
+                    artist,
+                    os.path.basename(path),
+                    duration,
+                )
+                for path, title, artist, duration in self._db.execute(
+                    'SELECT path, title, artist, duration FROM tracks',
+                )
+            }
+
+    def _scan_directory(self, path, parent):
+        full_path = os.path.join(self.directory, path)
+        mtime = os.stat(full_path).st_mtime
+        row = self._db.execute(
+            'SELECT mtime FROM directories WHERE path = ?',
+            (path,),
+        ).fetchone()
+        if row and row[0] == mtime:
+            subdirectories = [
+                subdirectory for subdirectory, in self._db.execute(
+                    'SELECT path FROM directories WHERE parent = ?',
+                    (path,),
+                )
+            ]
+        else:
+            subdirectories = self._update_directory(path, parent, mtime)
+        for subdirectory in subdirectories:
+            self._scan_directory(subdirectory, path)
+
+    def _update_directory(self, path, parent, mtime):
+        """Reads contents of modified directory, returns its subdirectories"""
+        full_path = os.path.join(self.directory, path)
+        known = {
+            track: (track_mtime, size)
+            for track, track_mtime, size in self._db.execute(
+                'SELECT path, mtime, size FROM tracks WHERE directory = ?',
+                (path,),
+            )
+        }
+        subdirectories = []
+        found = set()
+        for filename in sorted(os.listdir(full_path)):
+            relative = os.path.normpath(os.path.join(path, filename))
+            if os.path.isdir(os.path.join(full_path, filename)):
+                subdirectories.append(relative)
+                continue
+            if not filename.endswith('mp3'):
+                continue
+            try:
+                stat = os.stat(os.path.join(full_path, filename))
+                if known.get(relative) == (stat.st_mtime, stat.st_size):
+                    found.add(relative)
+                    continue
+                title, artist, duration = read_tags(
+                    os.path.join(full_path, filename),
+                )
+            except (MutagenError, OSError):
+                continue  # broken track, it's not indexed
+            found.add(relative)
+            self._db.execute(
+                'INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (relative, path, stat.st_mtime, stat.st_size, title, artist,
+                 duration),
+            )
+        for track in set(known) - found:
+            self._db.execute('DELETE FROM tracks WHERE path = ?', (track,))
+        for subdirectory, in self._db.execute(
+            'SELECT path FROM directories WHERE parent = ?',
+            (path,),
+        ).fetchall():
+            if subdirectory not in subdirectories:
+                self._remove_directory(subdirectory)
+        self._db.execute(
+            'INSERT OR REPLACE INTO directories VALUES (?, ?, ?)',
+            (path, parent, mtime),
+        )
+        return subdirectories
+
+    def _remove_directory(self, path):
+        """Removes directory, along with its tracks and subdirectories"""
+        for subdirectory, in self._db.execute(
+            'SELECT path FROM directories WHERE parent = ?',
+            (path,),
+        ).fetchall():
+            self._remove_directory(subdirectory)
+        self._db.execute('DELETE FROM tracks WHERE directory = ?', (path,))
+        self._db.execute('DELETE FROM directories WHERE path = ?', (path,))
+
+    def get_filenames(self):
+        """Returns dictionary of all tracks, with numbers from 1 as keys
+
+        Just like `utils.get_filenames`, but sorted by path.
+        """
+        return {
+            i: path for i, path in enumerate(sorted(self._tracks), start=1)
+        }
+
+    def get_info(self, filename):
+        """Returns tuple of string info about the song
+
+        Same as `audio.get_info`, but without opening the file.
+        """
+        title, artist, basename, _ = self._tracks[filename]
+        return title, artist, basename
@@ -0,0 +1,115 @@
+"""Background loading of upcoming tracks
+
+Tracks are shuffled with known seed, so it's easy to guess which ones will be
+selected next. These are loaded by a pool of workers while the current round
+is being played.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+import config
+import timing
+
+
+class Prefetcher(object):
+    """Loads tracks in the background and keeps them until they're needed
+
+    `load` is a function taking filename and returning ready to use track.
+    Loaded tracks are kept in memory until they're taken with `get`, or until
+    they exceed memory budget (oldest ones are dropped first).
+    """
+    def __init__(self, load, workers=None, budget=None):
+        self._load = load
+        self._executor = ThreadPoolExecutor(
+            workers or config.PREFETCH_WORKERS,
+        )
+        # Tracks needed right away don't wait behind the upcoming ones
+        self._foreground = ThreadPoolExecutor(config.LOAD_WORKERS)
+        self._budget = budget or config.PREFETCH_MEMORY_BUDGET
+        self._futures = OrderedDict()
+        self._lock = threading.RLock()
+
+    def schedule(self, filenames):
+        """Starts loading given tracks, unless they're already loaded"""
+        with self._lock:
+            for filename in filenames:
+                if filename in self._futures:
+                    continue
+                future = self._executor.submit(self._load, filename)
+                future.add_done_callback(lambda f: self._enforce_budget())
+                self._futures[filename] = future
+
+    def get(self, filename):
+        """Returns track, waiting for it or loading it if needed"""
+        with self._lock:
+            future = self._futures.pop(filename, None)
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception:
+                pass  # let's try again, this time not in the background
+        return self._load(filename)
+
+    def get_many(self, filenames, progress=None):
+        """Returns list of tracks, loading the missing ones concurrently
+
+        Tracks that weren't picked up by background workers yet are loaded
+        by separate pool, all at once. `progress` is called with filename
+        whenever one of the tracks is ready.
+        """
+        futures = {}
+        with self._lock:
+            for filename in filenames:
+                future = self._futures.pop(filename, None)
+                if future is None or future.cancel() or future.cancelled():
+                    future = self._foreground.submit(
+                        self._load_now,
+                        filename,
+                    )
+                futures[future] = filename
+        tracks = {}
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                tracks[filename] = future.result()
+            except Exception:
+                # Let's try again, this time not in the background
+                tracks[filename] = self._load(filename)
+            if progress:
+                progress(filename)
+        return [tracks[filename] for filename in filenames]
+
+    def cancel(self):
+        """Drops all pending and loaded tracks"""
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+
+    def shutdown(self):
+        """Stops all workers"""
+        self.cancel()
+        self._executor.shutdown(wait=False)
+        self._foreground.shutdown(wait=False)
+
+    def _load_now(self, filename):
+        """Loads track that's waited for, so it's timed as foreground"""
+        with timing.context(background=False):
+            return self._load(filename)
+
+    def _enforce_budget(self):
+        """Drops oldest loaded tracks when they take too much memory"""
+        with self._lock:
+            loaded = [
+                (filename, future)
+                for filename, future in self._futures.items()
+                if future.done() and not future.cancelled() and
+                future.exception() is None
+            ]
+            total = sum(len(future.result()._data) for _, future in loaded)
+            for filename, future in loaded:
+                if total <= self._budget:
+                    break
+                total -= len(future.result()._data)
+                del self._futures[filename]
@@ -0,0 +1,184 @@
+"""Offline rendering of the whole contest
+
+Tracks are shuffled with the same seed as in the settings form, and every
+round (along with additional tracks, mixing and filters) is rendered in
+advance, in parallel, to WAV files. Interface replays them when the output
+directory is selected as tracks directory, so there's nothing left to render
+during the contest.
+
+    python prerender.py tracks/ --seed "this is some random seed"
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import json
+import multiprocessing
+import os
+import os.path
+import random
+import time
+
+import audio
+import filters
+import library
+import utils
+
+
+MANIFEST_FILENAME = 'contest.json'
+DEFAULT_SEED = 'this is some random seed'
+
+
+def plan(directory, seed, rounds=None):
+    """Chooses tracks and filters of every round
+
+    Tracks are played in order of their numbers, just like during the live
+    contest; additional tracks are taken from the ones that weren't played
+    yet. Returns list of rounds, without rendering anything.
+    """
+    tracks = library.Library(directory)
+    tracks.scan()
+    filenames = utils.shuffle(tracks.get_filenames(), seed=seed)
+    random.seed(seed)
+    left = sorted(filenames)
+    result = []
+    while left and (rounds is None or len(result) < rounds):
+        numbers = filters.get_additional_tracks(left[0], left)
+        for no in numbers:
+            left.remove(no)
+        result.append({
+            'round': len(result) + 1,
+            'numbers': numbers,
+            'tracks': [filenames[no] for no in numbers],
+            'infos': [list(tracks.get_info(filenames[no])) for no in numbers],
+            'filters': filters.get_random_filters(),
+        })
+    return result
+
+
+def initialize():
+    """Indexes filter banks, once in every worker process"""
+    filters.initialize_panzer_tracks()
+    filters.initialize_overlay_tracks()
+
+
+def render(entry, settings, output_dir):
+    """Renders single round and saves it as WAV file
+
+    Random generator is seeded with the round number, so that the round
+    sounds the same no matter in which process (and order) it's rendered.
+    """
+    rng = random.Random('{seed}:{round}'.format(
+        seed=settings['seed'],
+        round=entry['round'],
+    ))
+    length = settings['length'] * 1000
+    tracks = []
+    for filename in entry['tracks']:
+        if settings['already_cut']:
+            tracks.append(audio.load(filename))
+        else:
+            tracks.append(audio.load_cut(filename, length * 2, rng=rng))
+    track = filters.multiple_tracks(tracks, rng)
+    track = filters.apply(track, entry['filters'], length, rng=rng)
+    temp_filename = os.path.join(output_dir, '.{file}.part'.format(
+        file=entry['file'],
+    ))
+    track.export(temp_filename, format='wav')
+    os.replace(temp_filename, os.path.join(output_dir, entry['file']))
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('directory', help='tracks directory')
+    parser.add_argument(
+        '--output',
+        default='contest',
+        help='where to save rendered rounds (default: %(default)s)',
+    )
+    parser.add_argument('--seed', default=DEFAULT_SEED)
+    parser.add_argument(
+        '--length',
+        type=int,
+        default=35,
+        help='track length, in seconds (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--rounds',
+        type=int,
+        help='number of rounds (default: as many as there are tracks)',
+    )
+    parser.add_argument(
+        '--not-cut',
+        dest='already_cut',
+        action='store_false',
+        help='tracks in the directory are not cut to twice the length',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of processes (default: %(default)s)',
+    )
+    args = parser.parse_args()
+    settings = {
+        'directory': os.path.abspath(args.directory),
+        'seed': args.seed,
+        'length': args.length,
+        'already_cut': args.already_cut,
+    }
+
+    if not os.path.exists(args.output):
+        os.mkdir(args.output)
+    rounds = plan(args.directory, args.seed, args.rounds)
+    for entry in rounds:
+        entry['file'] = 'round-{round:03d}.wav'.format(round=entry['round'])
+    # Rounds rendered before with the same settings are kept
+    manifest = utils.load_manifest(args.output, MANIFEST_FILENAME)
+    if manifest is None or manifest['settings'] != settings:
+        manifest = {'settings': settings, 'rounds': []}
+    done = {
+        json.dumps(entry, sort_keys=True)
+        for entry in manifest['rounds']
+        if os.path.exists(os.path.join(args.output, entry['file']))
+    }
+    manifest['rounds'] = []
+    jobs = []
+    for entry in rounds:
+        if json.dumps(entry, sort_keys=True) in done:
+            manifest['rounds'].append(entry)
+        else:
+            jobs.append(entry)
+    if len(jobs) < len(rounds):
+        print('Skipping {count} already rendered rounds.'.format(
+            count=len(rounds) - len(jobs),
+        ))
+
+    started = time.time()
+    with ProcessPoolExecutor(
+        args.workers,
+        initializer=initialize,
+    ) as executor:
+        futures = [
+            executor.submit(render, entry, settings, args.output)
+            for entry in jobs
+        ]
+        for i, future in enumerate(as_completed(futures), start=1):
+            entry = future.result()
+            manifest['rounds'].append(entry)
+            manifest['rounds'].sort(key=lambda r: r['round'])
+            utils.save_manifest(args.output, MANIFEST_FILENAME, manifest)
+            utils.pretty_print(
+                'Rendered round {i}/{total} ({speed:.1f} rounds/min) '
+                '[{filters}]'.format(
+                    i=i,
+                    total=len(jobs),
+                    speed=i / (time.time() - started) * 60,
+                    filters=', '.join(entry['filters']) or 'no filters',
+                ),
+            )
+    print()
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Speculative rendering of filtered tracks
+
+Filters are known before play button is pressed, so the track can be rendered
+in the background in the meantime. Each change of the track or filters
+cancels previous render and starts a new one.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+
+import filters
+import timing
+
+
+def _apply(track, filters_list, length, cancel=None, seed=None):
+    return filters.apply(
+        track,
+        filters_list,
+        length,
+        cancel,
+        random.Random(seed),
+    )
+
+
+class Renderer(object):
+    """Renders tracks with filters applied, one at a time, in the background
+
+    `render` takes track, list of filters, length, cancel event and seed of
+    random generator, see `filters.apply` (which is used by default).
+    Random parameters of filters are drawn from generator seeded with `seed`
+    passed along with the track, so the track sounds the same no matter if
+    it's rendered in the background or right away.
+    """
+    def __init__(self, render=None):
+        self._render = render or _apply
+        self._executor = ThreadPoolExecutor(1)
+        self._lock = threading.Lock()
+        self._job = None
+        self._future = None
+        self._cancel = threading.Event()
+
+    def schedule(self, track, filters_list, length, seed=None):
+        """Starts rendering the track, cancelling previous render
+
+        Nothing is done if the same render is already scheduled.
+        """
+        job = (track, tuple(filters_list), length, seed)
+        with self._lock:
+            if self._job is not None and self._matches(job):
+                return
+            self._stop()
+            self._job = job
+            self._cancel = threading.Event()
+            self._future = self._executor.submit(
+                self._run,
+                timing.current(),
+                track,
+                list(filters_list),
+                length,
+                self._cancel,
+                seed,
+            )
+
+    def result(self, track, filters_list, length, seed=None):
+        """Returns rendered track
+
+        If it's not the one that was scheduled last, it's rendered right
+        away.
+        """
+        job = (track, tuple(filters_list), length, seed)
+        with self._lock:
+            future = None
+            if self._job is not None and self._matches(job):
+                future = self._future
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception:
+                pass  # let's try again, this time in the foreground
+        return self._render(track, filters_list, length, None, seed)
+
+    def ready(self, track, filters_list, length, seed=None):
+        """Returns rendered track, but only if it's already finished"""
+        job = (track, tuple(filters_list), length, seed)
+        with self._lock:
+            if self._job is None or not self._matches(job):
+                return None
+            future = self._future
+        if not future.done() or future.cancelled():
+            return None
+        if future.exception() is not None:
+            return None
+        return future.result()
+
+    def cancel(self):
+        """Cancels current render"""
+        with self._lock:
+            self._stop()
+
+    def shutdown(self):
+        """Cancels current render and stops the background thread"""
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _run(self, keys, *args):
+        """Renders the track, timed in the context it was scheduled in"""
+        with timing.context(*keys):
+            return self._render(*args)
+
+    def _matches(self, job):
+        track, filters_list, length, seed = self._job
+        return (
+            track is job[0] and
+            filters_list == job[1] and
+            length == job[2] and
+            seed == job[3]
+        )
+
+    def _stop(self):
+        self._cancel.set()
+        if self._future is not None:
+            self._future.cancel()
+        self._job = None
+        self._future = None
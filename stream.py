@@ -0,0 +1,281 @@
+"""Block-by-block audio processing
+
+Instead of rendering whole track before playing it, filters can process it in
+small blocks, so that playback starts as soon as the first block is ready.
+Blocks are NumPy arrays of (frames, channels) shape; each processor keeps
+track of its position, so that it can be fed with consecutive blocks.
+"""
+from collections import namedtuple
+import threading
+
+import numpy
+
+import dsp
+
+
+Format = namedtuple('Format', ['frame_rate', 'channels', 'sample_width'])
+
+
+def get_format(segment):
+    """Returns format of given segment"""
+    return Format(segment.frame_rate, segment.channels, segment.sample_width)
+
+
+def ms_to_frames(stream_format, length):
+    """Converts length in ms to number of frames"""
+    return int(length * stream_format.frame_rate / 1000)
+
+
+def split(samples, block_frames):
+    """Yields consecutive blocks of samples"""
+    for start in range(0, len(samples), block_frames):
+        yield samples[start:start + block_frames]
+
+
+def process(blocks, processor, stage=None):
+    """Yields blocks passed through the processor
+
+    Time spent processing is recorded as `stage` (see `timing.Stage`), if
+    it's passed, once the stream ends.
+    """
+    try:
+        for block in blocks:
+            if stage is None:
+                yield processor.process(block)
+                continue
+            with stage.part(block.nbytes):
+                result = processor.process(block)
+            yield result
+    finally:
+        if stage is not None:
+            stage.finish()
+
+
+def buffered(blocks, stream_format, function, block_frames, stage=None):
+    """Yields blocks processed by function requiring whole track at once
+
+    `function` takes and returns array of samples. Nothing is yielded until
+    all input blocks are collected. Time spent in the function is recorded
+    as `stage`, if it's passed.
+    """
+    collected = [block for block in blocks]
+    if not collected:
+        return
+    dtype = dsp.DTYPES[stream_format.sample_width]
+    info = numpy.iinfo(dtype)
+    samples = numpy.concatenate([
+        numpy.clip(block, info.min, info.max).astype(dtype, copy=False)
+        for block in collected
+    ])
+    if stage is None:
+        samples = function(samples)
+    else:
+        with stage.part(samples.nbytes):
+            samples = function(samples)
+        stage.finish()
+    for block in split(samples, block_frames):
+        yield block
+
+
+def limit(blocks, frames):
+    """Yields blocks until given number of frames is reached"""
+    for block in blocks:
+        if frames <= 0:
+            break
+        yield block[:frames]
+        frames -= len(block)
+
+
+def encode(blocks, stream_format):
+    """Yields blocks converted to raw PCM data"""
+    for block in blocks:
+        yield dsp.to_bytes(block, stream_format.sample_width)
+
+
+class VolumeChanger(object):
+    """Changes volume of every other slice, see `audio.volume_changer`"""
+    def __init__(self, stream_format, slice_length, gain, ramp_length=0):
+        self.slice_frames = ms_to_frames(stream_format, slice_length)
+        self.ramp_frames = ms_to_frames(stream_format, ramp_length)
+        self.gain = gain
+        self.position = 0
+
+    def process(self, block):
+        envelope = dsp.gain_envelope(
+            len(block),
+            self.slice_frames,
+            self.gain,
+            self.ramp_frames,
+            self.position,
+        )
+        self.position += len(block)
+        return block * envelope
+
+
+class Frequency(object):
+    """Worsens quality by resampling to lower frequency and back again
+
+    Unlike `audio.frequency`, frame rate of the stream stays the same, so the
+    result sounds the same but can be played on the same output stream.
+    Every output block is as long as the input one; resamplers hold back a
+    few frames at first, so the output is delayed by that much (and a bit
+    more, as the number of frames they give back varies from block to block).
+    Both resamplers use exactly inverse ratios, so the delay stays the same.
+    """
+    def __init__(self, stream_format, frequency):
+        self._down = dsp.Resampler(
+            stream_format.frame_rate,
+            frequency,
+            stream_format.channels,
+        )
+        self._up = self._down.inverse(stream_format.channels)
+        self._pending = numpy.zeros(
+            (0, stream_format.channels),
+            dtype=numpy.float32,
+        )
+        # Output of single low rate frame, twice - covers the variation
+        self._margin = 2 * -(-self._up.up // self._up.down) + 2
+        self.position = 0
+
+    def process(self, block):
+        pending = numpy.concatenate([
+            self._pending,
+            self._up.process(self._down.process(block)),
+        ])
+        if not self.position:
+            # Delayed only once, at the start of the stream
+            delay = max(len(block) - len(pending), 0) + self._margin
+            pending = numpy.concatenate([
+                numpy.zeros((delay, pending.shape[1]), dtype=numpy.float32),
+                pending,
+            ])
+        self.position += len(block)
+        self._pending = pending[len(block):]
+        return pending[:len(block)]
+
+
+class Interleave(object):
+    """Interleaves stream with another track, see `audio.mix_segments`
+
+    The other track is looped if it's too short, without copying it.
+    """
+    def __init__(self, stream_format, samples, slice_length, gain=1):
+        self.samples = samples
+        self.slice_frames = ms_to_frames(stream_format, slice_length)
+        self.gain = gain
+        self.position = 0
+
+    def process(self, block):
+        positions = self.position + numpy.arange(len(block))
+        self.position += len(block)
+        other = (positions // self.slice_frames) % 2 == 1
+        result = block.astype(numpy.float32)
+        indices = positions[other] % len(self.samples)
+        result[other] = self.samples[indices] * self.gain
+        return result
+
+
+class Overlay(object):
+    """Layers another track over the stream, see `audio.overlay`
+
+    If `peak` of the layer is passed, the layer is made `louder` as soon as
+    the stream it's mixed into gets louder than that.
+    """
+    def __init__(self, samples, gain=1, peak=None, louder=1):
+        self.samples = samples
+        self.gain = gain
+        self.layer_peak = peak
+        self.louder = louder
+        self.peak = 0
+        self.position = 0
+
+    def process(self, block):
+        indices = (self.position + numpy.arange(len(block))) % len(
+            self.samples,
+        )
+        self.position += len(block)
+        layer_gain = 1
+        if self.layer_peak is not None and len(block):
+            self.peak = max(self.peak, numpy.abs(block).max())
+            if self.peak > self.layer_peak:
+                layer_gain = self.louder
+        return block * self.gain + self.samples[indices] * layer_gain
+
+
+class Effects(object):
+    """Chain of processors that can be switched on and off while playing
+
+    `factory` takes name of the filter and returns new processor for it (or
+    None, if it can't be applied). Processors are applied in the order they
+    were given to `update`, and the ones switched on in the middle of the
+    stream start at its current position.
+    """
+    def __init__(self, stream_format, factory):
+        self.stream_format = stream_format
+        self._factory = factory
+        self._names = []
+        self._processors = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.position = 0
+
+    def update(self, names, background=False):
+        """Switches on given processors, and switches off the rest
+
+        Creating a processor may involve loading samples, so with
+        `background` it's done in another thread, and the processor is
+        switched on once it's ready.
+        """
+        names = list(names)
+        with self._lock:
+            self._names = names
+            for name in list(self._processors):
+                if name not in names:
+                    del self._processors[name]
+            missing = [
+                name for name in names
+                if name not in self._processors and name not in self._pending
+            ]
+            self._pending.update(missing)
+        if not missing:
+            return
+        if background:
+            thread = threading.Thread(target=self._create, args=(missing,))
+            thread.daemon = True
+            thread.start()
+        else:
+            self._create(missing)
+
+    def _create(self, names):
+        """Creates processors and switches them on, unless they're unwanted"""
+        for name in names:
+            processor = None
+            try:
+                processor = self._factory(name)
+            finally:
+                with self._lock:
+                    self._pending.discard(name)
+                    if processor is not None and name in self._names:
+                        processor.position = self.position
+                        self._processors[name] = processor
+
+    def process(self, data):
+        """Processes raw PCM data, returns raw PCM data of the same length
+
+        Lock is held only to pick the processors, so switching them never
+        waits for the processing (and the other way round).
+        """
+        sample_width = self.stream_format.sample_width
+        block = dsp.to_array(data, sample_width, self.stream_format.channels)
+        with self._lock:
+            self.position += len(block)
+            processors = [
+                self._processors[name]
+                for name in self._names
+                if name in self._processors
+            ]
+        if not processors:
+            return data
+        for processor in processors:
+            block = processor.process(block)
+        return dsp.to_bytes(block, sample_width)
@@ -0,0 +1,180 @@
+"""Timing of stages of every round
+
+Loading, cutting, mixing, filtering and starting the playback are measured
+(both wall time and amount of processed data), so that it's possible to find
+out afterwards why some round took so long to start.
+Stages are tagged with keys (filenames of tracks) of the context they were
+recorded in, so that the ones done in the background - e.g. prefetching
+upcoming tracks - are saved along with the round they were done for.
+"""
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+import config
+
+
+MAX_PENDING = 1000  # oldest records are dropped, if they're never flushed
+
+_LOCK = threading.Lock()
+_RECORDS = []
+_LOCAL = threading.local()
+
+
+def current():
+    """Returns keys of the context of current thread"""
+    return getattr(_LOCAL, 'keys', ())
+
+
+def in_background():
+    """Checks whether stages recorded in this thread are done in background
+
+    Only the main thread is in the foreground, unless stated otherwise with
+    `context`.
+    """
+    flag = getattr(_LOCAL, 'background', None)
+    if flag is None:
+        return threading.current_thread() is not threading.main_thread()
+    return flag
+
+
+@contextmanager
+def context(*keys, **flags):
+    """Tags stages recorded inside `with` block (in this thread) with keys
+
+    `background=False` marks them as done in the foreground, e.g. when
+    someone waits for the thread they're done in.
+    """
+    previous = current()
+    previous_flag = getattr(_LOCAL, 'background', None)
+    _LOCAL.keys = previous + keys
+    _LOCAL.background = flags.get('background', previous_flag)
+    try:
+        yield
+    finally:
+        _LOCAL.keys = previous
+        _LOCAL.background = previous_flag
+
+
+@contextmanager
+def stage(name, size=0):
+    """Measures time of the code inside `with` block
+
+    Yields dictionary, in which `bytes` can be updated if amount of processed
+    data is known only afterwards.
+    """
+    info = {'bytes': size}
+    started = time.time()
+    clock = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(name, time.perf_counter() - clock, info['bytes'], started)
+
+
+class Stage(object):
+    """Stage measured in parts, e.g. block by block
+
+    Keys are taken from the context it's created in, as parts may be
+    measured (and the stage recorded) later on, in another thread.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.keys = current()
+        self.started = None
+        self.seconds = 0
+        self.bytes = 0
+
+    @contextmanager
+    def part(self, size=0):
+        """Measures time of single part, inside `with` block"""
+        if self.started is None:
+            self.started = time.time()
+        clock = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - clock
+            self.bytes += size
+
+    def finish(self):
+        """Records the stage, if any part of it was measured"""
+        if self.started is None:
+            return
+        record(self.name, self.seconds, self.bytes, self.started, self.keys)
+
+
+def record(name, seconds, size=0, started=None, keys=None,
+           background=None):
+    """Records single stage, tagged with keys of current context by default
+
+    Stage is done in the background as told by `in_background()`, unless
+    stated otherwise (e.g. for stages done by other processes).
+    """
+    if not config.TIMING_ENABLED:
+        return
+    if background is None:
+        background = in_background()
+    with _LOCK:
+        _RECORDS.append({
+            'stage': name,
+            'started': started or time.time() - seconds,
+            'seconds': seconds,
+            'bytes': size,
+            'background': background,
+            'keys': list(current() if keys is None else keys),
+        })
+        del _RECORDS[:-MAX_PENDING]
+
+
+def _matches(record, keys):
+    """Checks if record belongs to given keys - untagged ones belong to all"""
+    return not record['keys'] or not set(record['keys']).isdisjoint(keys)
+
+
+def summary(keys=()):
+    """Returns compact summary of stages recorded in foreground for keys
+
+    Stages done in the background (e.g. prefetching) didn't keep anyone
+    waiting, so they're skipped.
+    """
+    with _LOCK:
+        records = [
+            r for r in _RECORDS
+            if not r['background'] and _matches(r, keys)
+        ]
+    totals = {}
+    for r in records:
+        totals[r['stage']] = totals.get(r['stage'], 0) + r['seconds']
+    return ', '.join(
+        '{stage} {seconds:.2f}s'.format(stage=name, seconds=seconds)
+        for name, seconds in sorted(totals.items(), key=lambda x: -x[1])
+    )
+
+
+def collect(keys=None):
+    """Returns recorded stages for given keys (all by default), clears them"""
+    with _LOCK:
+        if keys is None:
+            records = list(_RECORDS)
+            del _RECORDS[:]
+        else:
+            records = [r for r in _RECORDS if _matches(r, keys)]
+            _RECORDS[:] = [r for r in _RECORDS if not _matches(r, keys)]
+    return records
+
+
+def flush(keys=(), **info):
+    """Appends stages recorded for given keys to the log, and clears them
+
+    Untagged stages are flushed, too. Additional info (like track numbers or
+    filters) is saved along with them.
+    """
+    records = collect(keys)
+    if not config.TIMING_ENABLED or not records:
+        return
+    entry = {'time': time.time(), 'stages': records}
+    entry.update(info)
+    with open(config.TIMING_LOG, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
@@ -1,7 +1,10 @@
 """File utilities and helpers"""
+import importlib
+import json
 import os
 import os.path
 import random
+import sys
 
 
 def get_filenames(directory):
@@ -24,3 +27,47 @@ def shuffle(filenames, seed=None):
     random.seed(seed)
     random.shuffle(values)
     return {i: v for i, v in enumerate(values, start=1)}
+
+
+def pretty_print(msg):
+    """Prints message over the previous one, in the same line"""
+    sys.stdout.write('\r{msg}\033[K'.format(msg=msg))
+    sys.stdout.flush()
+
+
+def load_manifest(directory, filename, default=None):
+    """Loads JSON manifest from the directory, `default` if there's none"""
+    try:
+        with open(os.path.join(directory, filename)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def save_manifest(directory, filename, manifest):
+    """Atomically saves JSON manifest to the directory"""
+    path = os.path.join(directory, filename)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+class LazyModule(object):
+    """Module that is imported when it's used for the first time
+
+    Importing NumPy, pydub and the rest takes a while, and it's not needed to
+    display the first screen of the interface.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+def lazy_import(name):
+    """Returns module proxy, importing the module on first attribute access"""
+    return LazyModule(name)
@@ -0,0 +1,363 @@
+"""Out-of-process loading and rendering
+
+Loading, cutting, mixing and filtering is done by separate worker processes,
+so that they don't compete for the GIL with the interface and the player.
+Tracks are passed between processes through shared memory: only job
+descriptions and handles of the buffers are pickled, never the audio itself.
+Shared memory is registered with the resource tracker only by the process
+which creates it, and unregistered by the one which unlinks it.
+Jobs submitted in the foreground (someone's waiting for them) have separate
+queue and processes, so they never wait behind prefetching or speculative
+rendering.
+"""
+from concurrent.futures import Future, wait
+import itertools
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import random
+import threading
+import weakref
+
+import numpy
+import pydub
+
+import audio
+import config
+import filters
+import timing
+
+
+CANCEL_SLOTS = 1024  # more jobs than that are never pending at once
+CANCEL_CHECK_INTERVAL = 0.05  # in seconds
+
+_CLOSING = []
+_CLOSING_LOCK = threading.Lock()
+
+
+def _share(segment):
+    """Copies segment's data into new shared memory, returns its handle
+
+    Memory is closed, but not unlinked - that's up to the receiving side.
+    """
+    _close_released()
+    data = memoryview(segment._data).cast('B')
+    memory = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    memory.buf[:len(data)] = data
+    handle = {
+        'name': memory.name,
+        'size': len(data),
+        'frame_rate': segment.frame_rate,
+        'channels': segment.channels,
+        'sample_width': segment.sample_width,
+    }
+    memory.close()
+    return handle
+
+
+def _release(memory, unlink):
+    """Unlinks shared memory, and marks it to be closed"""
+    if unlink:
+        memory.unlink()
+    with _CLOSING_LOCK:
+        _CLOSING.append(memory)
+
+
+def _close_released():
+    """Closes shared memory that isn't used anymore
+
+    Memory can't be closed right when its data is garbage collected, as the
+    data still refers to it at that moment - so it's done afterwards.
+    """
+    with _CLOSING_LOCK:
+        closing = list(_CLOSING)
+        del _CLOSING[:]
+    left = []
+    for memory in closing:
+        try:
+            memory.close()
+        except BufferError:
+            left.append(memory)
+    with _CLOSING_LOCK:
+        _CLOSING.extend(left)
+
+
+def _open(name):
+    """Opens existing shared memory, without registering it again
+
+    Resource tracker is shared by all the processes, and it's already
+    registered by the process which created it.
+    """
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _attach(handle, unlink=False):
+    """Returns segment with data stored in shared memory, without copying it
+
+    Memory is closed (and unlinked, if requested) as soon as nothing refers
+    to the data anymore.
+    """
+    _close_released()
+    memory = _open(handle['name'])
+    data = numpy.frombuffer(
+        memory.buf,
+        dtype=numpy.uint8,
+        count=handle['size'],
+    )
+    weakref.finalize(data, _release, memory, unlink)
+    return pydub.AudioSegment(memoryview(data), metadata={
+        'sample_width': handle['sample_width'],
+        'frame_rate': handle['frame_rate'],
+        'channels': handle['channels'],
+        'frame_width': handle['sample_width'] * handle['channels'],
+    })
+
+
+class _Cancel(object):
+    """Cancel flag of single job, set by the interface process
+
+    Works like `threading.Event`, as far as `filters.apply` is concerned.
+    """
+    def __init__(self, flags, job_id):
+        self._flags = flags
+        self._slot = job_id % len(flags)
+
+    def is_set(self):
+        return bool(self._flags[self._slot])
+
+
+# Random generator of every job is seeded by the interface, so that results
+# don't depend on which process (and when) runs it
+def _load(cancel, filename, length=None, seed=None):
+    if length is None:
+        return audio.load(filename)
+    return audio.load_cut(filename, length, rng=random.Random(seed))
+
+
+def _cut(cancel, track, length, seed=None):
+    return audio.cut(_attach(track), length, rng=random.Random(seed))
+
+
+def _mix(cancel, tracks, seed=None):
+    return filters.multiple_tracks(
+        [_attach(track) for track in tracks],
+        random.Random(seed),
+    )
+
+
+def _apply(cancel, track, filters_list, length, seed=None):
+    return filters.apply(
+        _attach(track),
+        filters_list,
+        length,
+        cancel,
+        random.Random(seed),
+    )
+
+
+JOBS = {
+    'load': _load,
+    'cut': _cut,
+    'mix': _mix,
+    'apply': _apply,
+}
+
+
+def _serve(jobs, results, cancelled):
+    """Main loop of worker process, runs until None is received
+
+    Jobs cancelled before they're started are skipped, and rendering is
+    stopped as soon as its job is cancelled.
+    """
+    filters.initialize_panzer_tracks()
+    filters.initialize_overlay_tracks()
+    for job_id, kind, args in iter(jobs.get, None):
+        cancel = _Cancel(cancelled, job_id)
+        handle = None
+        error = None
+        try:
+            if not cancel.is_set():
+                segment = JOBS[kind](cancel, **args)
+                if segment is not None:
+                    handle = _share(segment)
+        except Exception as e:
+            handle = None
+            error = '{name}: {error}'.format(name=type(e).__name__, error=e)
+        results.put((job_id, handle, timing.collect(), error))
+
+
+class Worker(object):
+    """Sends jobs to worker processes, and receives their results
+
+    Every method returns Future of the resulting segment. Segments passed as
+    arguments must come from the worker, too - their handles are sent
+    instead of them. `seed` of every job seeds its random generator.
+    Jobs are run in the foreground or in the background depending on the
+    thread (and `timing.context`) they're submitted from.
+    """
+    def __init__(self, processes=None, foreground_processes=None):
+        # Interface runs a few threads already, so it's not safe to fork it
+        context = multiprocessing.get_context('spawn')
+        self._jobs = context.Queue()
+        self._urgent_jobs = context.Queue()
+        self._results = context.Queue()
+        self._cancelled = context.RawArray('b', CANCEL_SLOTS)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._handles = {}
+        queues = (
+            [self._jobs] * (processes or config.RENDER_WORKERS) +
+            [self._urgent_jobs] * (
+                foreground_processes or config.LOAD_WORKERS
+            )
+        )
+        self._processes = [
+            (
+                jobs,
+                context.Process(
+                    target=_serve,
+                    args=(jobs, self._results, self._cancelled),
+                ),
+            )
+            for jobs in queues
+        ]
+        for _, process in self._processes:
+            process.daemon = True
+            process.start()
+        thread = threading.Thread(target=self._receive)
+        thread.daemon = True
+        thread.start()
+
+    def load(self, filename, length=None, seed=None):
+        """Loads track; random part of it is cut if `length` is passed"""
+        return self._submit(
+            'load',
+            [],
+            filename=filename,
+            length=length,
+            seed=seed,
+        )
+
+    def cut(self, track, length, seed=None):
+        """Selects random part of the track"""
+        return self._submit(
+            'cut',
+            [track],
+            track=self._handle(track),
+            length=length,
+            seed=seed,
+        )
+
+    def mix(self, tracks, seed=None):
+        """Mixes multiple tracks, see `filters.multiple_tracks`"""
+        return self._submit(
+            'mix',
+            tracks,
+            tracks=[self._handle(track) for track in tracks],
+            seed=seed,
+        )
+
+    def apply(self, track, filters_list, length=None, seed=None):
+        """Applies filters on the track, see `filters.apply`"""
+        return self._submit(
+            'apply',
+            [track],
+            track=self._handle(track),
+            filters_list=list(filters_list),
+            length=length,
+            seed=seed,
+        )
+
+    def wait(self, future, cancel=None):
+        """Returns result of the job, or None if `cancel` event gets set
+
+        Job is cancelled in the worker process then, too.
+        """
+        while cancel is not None and not cancel.is_set():
+            done, _ = wait([future], CANCEL_CHECK_INTERVAL)
+            if done:
+                return future.result()
+        if cancel is not None:
+            future.cancel()
+            return None
+        return future.result()
+
+    def shutdown(self):
+        """Cancels pending jobs and stops worker processes"""
+        with self._lock:
+            futures = [job[0] for job in self._pending.values()]
+        for future in futures:
+            future.cancel()
+        for jobs, _ in self._processes:
+            jobs.put(None)
+        self._results.put(None)
+        for _, process in self._processes:
+            process.join(1)
+
+    def _handle(self, segment):
+        try:
+            return self._handles[id(segment)]
+        except KeyError:
+            raise ValueError('segment was not created by the worker')
+
+    def _submit(self, kind, inputs, **args):
+        future = Future()
+        with self._lock:
+            job_id = next(self._ids)
+            # Inputs are kept alive, so that their memory isn't unlinked
+            # before the worker gets to them. Stages timed by the worker
+            # are tagged with keys of the context the job was submitted in,
+            # and done in the background only if it was submitted there.
+            background = timing.in_background()
+            self._pending[job_id] = (
+                future,
+                inputs,
+                timing.current(),
+                background,
+            )
+            self._cancelled[job_id % CANCEL_SLOTS] = 0
+        future.add_done_callback(
+            lambda f: f.cancelled() and self._cancel(job_id),
+        )
+        jobs = self._jobs if background else self._urgent_jobs
+        jobs.put((job_id, kind, args))
+        return future
+
+    def _cancel(self, job_id):
+        """Tells worker processes to skip (or stop) the job"""
+        self._cancelled[job_id % CANCEL_SLOTS] = 1
+
+    def _receive(self):
+        """Passes results to futures, run in separate thread"""
+        for result in iter(self._results.get, None):
+            self._finish(*result)
+
+    def _finish(self, job_id, handle, records, error):
+        with self._lock:
+            future, _, keys, background = self._pending.pop(job_id)
+        for record in records:
+            timing.record(
+                record['stage'],
+                record['seconds'],
+                record['bytes'],
+                record['started'],
+                keys,
+                background,
+            )
+        segment = None
+        if handle is not None:
+            # Attached even if no one's waiting, so that it's unlinked
+            segment = _attach(handle, unlink=True)
+            self._handles[id(segment)] = handle
+            weakref.finalize(segment, self._handles.pop, id(segment), None)
+        if not future.set_running_or_notify_cancel():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(segment)